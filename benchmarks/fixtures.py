@@ -0,0 +1,373 @@
+''' fixtures.py
+    Deterministic synthetic FLYF2 responder payloads (publishing_names_sync,
+    initial_splits, linedata, doilist) and the matching SAGE and FlyBoy seed
+    rows for the offline benchmarks. Scale factor 1 approximates current
+    production volumes; the payloads include the edge cases the syncs have to
+    handle. Run as a program to write fixtures to disk.
+'''
+import argparse
+from datetime import date, datetime, timedelta
+import json
+import os
+import random
+import sys
+
+# Approximate production volumes (scale factor 1)
+BASE = {'lines': 15000, 'names': 12000, 'halves': 2500, 'splits': 3000,
+        'stocks': 20000, 'flipper': 15000, 'dois': 1200}
+# Relative frequency of each kind of publishing name row
+NAME_KINDS = {'name': 70, 'genotype': 8, 'looks_genotype': 4, 'flagged_genotype': 4,
+              'carriage_return': 2, 'not_for_publishing': 4, 'same_as_line': 4,
+              'unknown_stock': 2, 'empty': 2}
+# Relative frequency of each kind of initial split cross
+SPLIT_KINDS = {'new': 65, 'existing': 20, 'wrong_parents': 5, 'duplicate_halves': 4,
+               'missing_half': 4, 'three_halves': 2}
+# Relative frequency of each kind of doilist entry
+DOI_KINDS = {'single': 80, 'multiple': 10, 'datacite': 5, 'in_prep': 5}
+# Fraction of StockFinder Robot IDs that are duplicated
+DUPLICATE_ROBOTS = 0.05
+# Fraction of publishing names and DOIs that are already in SAGE/FlyBoy
+EXISTING = 0.5
+CV = {'lab': 1, 'line': 2, 'relationship': 3}
+TERMS = [('lab', 'flylight'), ('line', 'flycore_id'), ('line', 'hide'),
+         ('line', 'flycore_permission'), ('line', 'flycore_project'),
+         ('line', 'flycore_project_subcat'), ('line', 'flycore_lab'),
+         ('line', 'flycore_alias'), ('relationship', 'child_of'),
+         ('relationship', 'parent_of')]
+TERM_ID = {term: idx for idx, (_, term) in enumerate(TERMS, start=1)}
+NOW = datetime(2024, 1, 1)
+SQL_CHUNK = 1000
+
+
+def table(columns, rows=None):
+    """ Return an empty (or populated) table
+        Keyword arguments:
+          columns: column names
+          rows: list of row tuples
+        Returns:
+          Table dictionary
+    """
+    return {'columns': columns, 'rows': rows or []}
+
+
+def choose(rng, kinds):
+    """ Pick a kind using its relative frequency
+        Keyword arguments:
+          rng: random number generator
+          kinds: dictionary of kind: relative frequency
+        Returns:
+          Kind
+    """
+    return rng.choices(list(kinds), weights=list(kinds.values()))[0]
+
+
+def sage_tables():
+    """ Return SAGE tables with the controlled vocabulary loaded
+        Keyword arguments:
+          None
+        Returns:
+          Dictionary of table name: table
+    """
+    return {'cv': table(['id', 'name'], [(cid, name) for name, cid in CV.items()]),
+            'cv_term': table(['id', 'cv_id', 'name'],
+                             [(TERM_ID[term], CV[cvn], term) for cvn, term in TERMS]),
+            'line': table(['id', 'name', 'lab_id']),
+            'line_property': table(['line_id', 'type_id', 'value']),
+            'line_relationship': table(['subject_id', 'type_id', 'object_id']),
+            'publishing_name': table(['line_id', 'source_id', 'publishing_name',
+                                      'for_publishing', 'published', 'label',
+                                      'display_genotype', 'requester', 'notes',
+                                      'source_create_date', 'preferred_name'])}
+
+
+def flyboy_tables():
+    """ Return empty FlyBoy tables
+        Keyword arguments:
+          None
+        Returns:
+          Dictionary of table name: table
+    """
+    return {'StockFinder': table(['__kp_UniqueID', 'RobotID', 'Stock_Name', 'Genotype',
+                                  'Lab_ID']),
+            '__flipper_flystocks_stock': table(['stock_id', 'genotype', 'rack_location',
+                                                'cell', 'last_flipped', 'rack',
+                                                'rack_location_b', 'cell_b',
+                                                'last_flipped_b', 'rack_b']),
+            'doi_data': table(['doi', 'title', 'first_author', 'publication_date'])}
+
+
+def add_line(sage, name):
+    """ Add a line to SAGE
+        Keyword arguments:
+          sage: SAGE tables
+          name: line name
+        Returns:
+          Line ID
+    """
+    line_id = len(sage['line']['rows']) + 1
+    sage['line']['rows'].append((line_id, name, TERM_ID['flylight']))
+    return line_id
+
+
+def add_relationships(sage, line_id, parents):
+    """ Add child_of/parent_of relationships for a line
+        Keyword arguments:
+          sage: SAGE tables
+          line_id: child line ID
+          parents: parent line IDs
+        Returns:
+          None
+    """
+    for parent in parents:
+        sage['line_relationship']['rows'].append((line_id, TERM_ID['child_of'], parent))
+        sage['line_relationship']['rows'].append((parent, TERM_ID['parent_of'], line_id))
+
+
+def publishing_name_row(rng, num, stock, kind):
+    """ Build a publishing_names_sync row
+        Keyword arguments:
+          rng: random number generator
+          num: serial number
+          stock: stock (line) number
+          kind: kind of row (see NAME_KINDS)
+        Returns:
+          _kf_parent_UID, __kp_name_serial_number, all_names, for_publishing,
+          published, label, display_genotype, who, notes, create_date
+    """
+    pname = f"SS{stock:05d}" if rng.random() < 0.5 else f"SS{stock:05d}-{num % 10}"
+    genotype = ''
+    for_publishing = 'Yes'
+    if kind == 'genotype':
+        pname, genotype = f"w[1118]; P{{{pname}}}", 'Yes'
+    elif kind == 'looks_genotype':
+        pname = f"w;{pname}"
+    elif kind == 'flagged_genotype':
+        genotype = 'Yes'
+    elif kind == 'carriage_return':
+        pname = f"{pname}\r\n{pname}-b"
+    elif kind == 'not_for_publishing':
+        for_publishing = 'No'
+    elif kind == 'same_as_line':
+        pname = f"JRC_SS{stock:05d}"
+    elif kind == 'empty':
+        pname = None
+    created = NOW - timedelta(days=rng.randint(0, 3), seconds=rng.randint(0, 86399))
+    return [stock, 100000 + num, pname, for_publishing, rng.choice(['Yes', 'No', '']),
+            rng.choice(['Yes', '']), genotype, rng.choice(['flylight', 'rubin', None]),
+            rng.choice(['', 'Renamed', None]), created.strftime('%Y-%m-%d %H:%M:%S')]
+
+
+def add_publishing(rng, data, size):
+    """ Add stock lines to SAGE and publishing names to FLYF2
+        Keyword arguments:
+          rng: random number generator
+          data: fixture dictionary
+          size: row counts
+        Returns:
+          None
+    """
+    sage = data['sage']
+    line_id = {}
+    for stock in range(1, size['lines'] + 1):
+        line_id[stock] = add_line(sage, f"JRC_SS{stock:05d}")
+        sage['line_property']['rows'].append((line_id[stock], TERM_ID['flycore_id'],
+                                              str(stock)))
+    names = []
+    seen = set()
+    for num in range(1, size['names'] + 1):
+        kind = choose(rng, NAME_KINDS)
+        stock = rng.randint(1, max(1, size['lines']))
+        row = publishing_name_row(rng, num, stock, kind)
+        if kind == 'unknown_stock':
+            row[0] = size['lines'] + num
+        names.append(row)
+        if kind in ('name', 'genotype') and rng.random() < EXISTING \
+           and (stock, row[2]) not in seen:
+            seen.add((stock, row[2]))
+            sage['publishing_name']['rows'].append(
+                (line_id[stock], row[1], row[2], 1, int(row[4] == 'Yes'),
+                 int(row[5] == 'Yes'), int(kind == 'genotype'), row[7], row[8], row[9], 0))
+    data['flycore']['publishing_names_sync'] = {'publishing': names}
+    data['flycore']['publishing_names_join'] = {'publishing': names[:1]}
+
+
+def add_splits(rng, data, size):
+    """ Add split halves to SAGE and initial split crosses to FLYF2
+        Keyword arguments:
+          rng: random number generator
+          data: fixture dictionary
+          size: row counts
+        Returns:
+          None
+    """
+    sage = data['sage']
+    ads, dbds = [], []
+    for num in range(1, size['halves'] + 1):
+        ads.append((f"JRC_AD{num:05d}", add_line(sage, f"JRC_AD{num:05d}")))
+        dbds.append((f"JRC_DBD{num:05d}", add_line(sage, f"JRC_DBD{num:05d}")))
+    splits = []
+    for num in range(1, size['splits'] + 1):
+        kind = choose(rng, SPLIT_KINDS)
+        (adn, adid), (dbdn, dbdid) = rng.choice(ads), rng.choice(dbds)
+        halves = [adn, dbdn]
+        if kind == 'duplicate_halves':
+            halves = [adn, adn]
+        elif kind == 'missing_half':
+            halves = [adn, f"JRC_DBD{size['halves'] + num:05d}"]
+        elif kind == 'three_halves':
+            halves = [adn, dbdn, rng.choice(dbds)[0]]
+        split = {'line': f"JRC_IS{num:05d}", 'genotype': '-x-'.join(halves),
+                 'cross_barcode': str(30000000 + num)}
+        splits.append(split)
+        if kind in ('existing', 'wrong_parents'):
+            line_id = add_line(sage, split['line'])
+            parents = [adid, dbdid] if kind == 'existing' else [adid, rng.choice(dbds)[1]]
+            add_relationships(sage, line_id, sorted(set(parents)))
+            sage['line_property']['rows'].append((line_id, TERM_ID['flycore_alias'],
+                                                  split['genotype']))
+    data['flycore']['initial_splits'] = {'splits': splits}
+    data['flycore']['initial_split'] = {'splits': splits[:1]}
+
+
+def add_stocks(rng, data, size):
+    """ Add StockFinder and flipper stock rows to FlyBoy, and FLYF2 linedata responses
+        Keyword arguments:
+          rng: random number generator
+          data: fixture dictionary
+          size: row counts
+        Returns:
+          None
+    """
+    flyboy = data['flyboy']
+    duplicates = int(size['stocks'] * DUPLICATE_ROBOTS)
+    linedata = {}
+    for kpid in range(1, size['stocks'] + 1):
+        robotid = kpid if kpid > duplicates else rng.randint(duplicates + 1, size['stocks'])
+        flyboy['StockFinder']['rows'].append((kpid, robotid, f"JRC_SS{kpid:05d}",
+                                              f"w1118; P{{JRC_SS{kpid:05d}}}", 'FL'))
+        if kpid <= duplicates or robotid <= duplicates:
+            linedata[str(kpid)] = {'linedata': '' if rng.random() < 0.5 else
+                                   {'__kp_UniqueID': kpid,
+                                    'Stock_Name': f"JRC_SS{kpid:05d}"}}
+    data['flycore']['linedata'] = {'by': 'kp', 'responses': linedata,
+                                   'default': {'linedata': {'__kp_UniqueID': 0}}}
+    trays = max(1, size['flipper'] // 96)
+    for stock in range(1, size['flipper'] + 1):
+        flipped = NOW - timedelta(days=rng.randint(0, 400))
+        flyboy['__flipper_flystocks_stock']['rows'].append(
+            (stock, f"w1118; stock {stock}", f"A.GR{rng.randint(1, trays):04d}.1",
+             rng.randint(1, 96), flipped, f"R{rng.randint(1, 40)}",
+             f"B.GR{rng.randint(1, trays):04d}.1", rng.randint(1, 96),
+             flipped + timedelta(days=1), None))
+
+
+def add_dois(rng, data, size):
+    """ Add FLYF2 doilist entries and existing FlyBoy doi_data rows
+        Keyword arguments:
+          rng: random number generator
+          data: fixture dictionary
+          size: row counts
+        Returns:
+          None
+    """
+    entries = []
+    dois = []
+    for num in range(1, size['dois'] + 1):
+        kind = choose(rng, DOI_KINDS)
+        doi = f"10.1101/2023.{num:06d}"
+        if kind == 'multiple':
+            extra = f"10.7554/eLife.{num:05d}"
+            entries.append(rng.choice([f"{doi}|{extra}", f"{doi} | {extra}",
+                                       f"{doi} |{extra} | in prep"]))
+            dois.extend([doi, extra])
+        elif kind == 'datacite':
+            doi = f"10.25378/janelia.{num:07d}"
+            entries.append(doi)
+            dois.append(doi)
+        elif kind == 'in_prep':
+            entries.append('in prep')
+        else:
+            entries.append(doi)
+            dois.append(doi)
+    existing = [doi for doi in dois if rng.random() < EXISTING]
+    # DOIs no longer in FLYF2 are removed by the back-check
+    existing.extend(f"10.1101/retired.{num:06d}" for num in range(size['dois'] // 50))
+    data['flyboy']['doi_data']['rows'] = [(doi, f"Title of {doi}", 'Author',
+                                           str(rng.randint(2005, 2023)))
+                                          for doi in existing]
+    data['flycore']['doilist'] = {'dois': entries}
+
+
+def generate(scale=1, seed=0):
+    """ Generate benchmark data
+        Keyword arguments:
+          scale: scale factor (1 = approximate production volume)
+          seed: random seed
+        Returns:
+          Dictionary with 'sage' and 'flyboy' tables and 'flycore' payloads
+    """
+    rng = random.Random(seed)
+    size = {key: max(1, int(val * scale)) for key, val in BASE.items()}
+    data = {'sage': sage_tables(), 'flyboy': flyboy_tables(), 'flycore': {}}
+    add_publishing(rng, data, size)
+    add_splits(rng, data, size)
+    add_stocks(rng, data, size)
+    add_dois(rng, data, size)
+    return data
+
+
+def sql_literal(value):
+    """ Return a SQL literal for a value
+        Keyword arguments:
+          value: value
+        Returns:
+          SQL literal
+    """
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat(sep=' ') if isinstance(value, datetime) else value.isoformat()
+    value = str(value).replace('\\', '\\\\').replace("'", "\\'")
+    return "'" + value.replace('\r', '\\r').replace('\n', '\\n') + "'"
+
+
+def write_fixtures(data, directory):
+    """ Write payloads as <request>.json and seed rows as <database>.sql
+        Keyword arguments:
+          data: fixture data from generate
+          directory: output directory
+        Returns:
+          None
+    """
+    os.makedirs(os.path.join(directory, 'flycore'), exist_ok=True)
+    for name, payload in data['flycore'].items():
+        with open(os.path.join(directory, 'flycore', name + '.json'), 'w',
+                  encoding='utf-8') as outstream:
+            json.dump(payload, outstream)
+    for source in ('sage', 'flyboy'):
+        with open(os.path.join(directory, source + '.sql'), 'w',
+                  encoding='utf-8') as outstream:
+            for name, tbl in data[source].items():
+                for idx in range(0, len(tbl['rows']), SQL_CHUNK):
+                    values = ',\n'.join('(' + ','.join(sql_literal(val) for val in row) + ')'
+                                        for row in tbl['rows'][idx:idx + SQL_CHUNK])
+                    outstream.write(f"INSERT INTO {name} ({','.join(tbl['columns'])}) "
+                                    + f"VALUES\n{values};\n")
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(
+        description="Write synthetic FLYF2 payloads and SAGE/FlyBoy seed rows")
+    PARSER.add_argument('--scale', dest='SCALE', type=float, nargs='+', default=[1, 10, 100],
+                        help='Scale factors [1 10 100]')
+    PARSER.add_argument('--seed', dest='SEED', type=int, default=0, help='Random seed')
+    PARSER.add_argument('--output', dest='OUTPUT', action='store', default='fixtures',
+                        help='Output directory [fixtures]')
+    ARG = PARSER.parse_args()
+    for SCALE in ARG.SCALE:
+        DIRECTORY = os.path.join(ARG.OUTPUT, f"x{SCALE:g}")
+        write_fixtures(generate(SCALE, ARG.SEED), DIRECTORY)
+        print(f"Wrote scale {SCALE:g} fixtures to {DIRECTORY}")
+    sys.exit(0)
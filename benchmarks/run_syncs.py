@@ -0,0 +1,305 @@
+''' run_syncs.py
+    Offline end-to-end benchmark of the FLYF2 sync programs. A local MySQL
+    (or MariaDB) server is loaded with synthetic SAGE and FlyBoy data, the
+    config service and FLYF2 responder are replaced by stub_server.py, and
+    each sync is timed while its queries and HTTP calls are counted.
+    Per-phase and per-statement timings come from the programs' --metrics.
+'''
+import argparse
+import getpass
+import json
+import logging
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import MySQLdb
+import fixtures
+import stub_server
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BIN = os.path.join(ROOT, 'bin')
+SCHEMA = {'sage': [os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema',
+                                'sage.sql')],
+          'flyboy': [os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema',
+                                  'flyboy.sql'),
+                     os.path.join(ROOT, 'sql', 'flipper_stock_tray_columns.sql')]}
+# Benchmark databases use their own names so a shared server is never clobbered
+DATABASE = {'sage': 'bench_sage', 'flyboy': 'bench_flyboy'}
+MANIFOLD = 'bench'
+SYNCS = [('sync_flyf_publishing_names.py', ['--write']),
+         ('sync_flyf_initial_splits.py', ['--write']),
+         ('flyboy_check_robotids.py', ['--write'])]
+STATUS = ['Questions', 'Com_select', 'Com_insert', 'Com_update', 'Com_delete',
+          'Com_call_procedure']
+INSERT_CHUNK = 1000
+LOGGER = logging.getLogger(__name__)
+
+
+def free_port():
+    """ Return an unused local TCP port """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_mysqld(workdir):
+    """ Initialize and start a throwaway MySQL or MariaDB server
+        Keyword arguments:
+          workdir: directory for the data directory and socket
+        Returns:
+          server process, connection parameters
+    """
+    datadir = os.path.join(workdir, 'mysql')
+    user = getpass.getuser()
+    if shutil.which('mariadb-install-db') or shutil.which('mysql_install_db'):
+        install = shutil.which('mariadb-install-db') or shutil.which('mysql_install_db')
+        server = shutil.which('mariadbd') or shutil.which('mysqld')
+        cmd = [install, f"--datadir={datadir}", f"--user={user}",
+               '--auth-root-authentication-method=normal']
+    elif shutil.which('mysqld'):
+        server = shutil.which('mysqld')
+        cmd = [server, '--initialize-insecure', f"--datadir={datadir}", f"--user={user}"]
+    else:
+        LOGGER.critical("No mysqld/mariadbd found: install one or use --mysql")
+        sys.exit(-1)
+    subprocess.run(cmd, check=True, capture_output=True)
+    port = free_port()
+    proc = subprocess.Popen([server, '--no-defaults', f"--datadir={datadir}", f"--user={user}",
+                             f"--port={port}", '--bind-address=127.0.0.1',
+                             f"--socket={os.path.join(workdir, 'mysql.sock')}",
+                             '--skip-log-bin', '--log-bin-trust-function-creators=1'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    dsn = {'host': '127.0.0.1', 'port': port, 'user': 'root', 'password': ''}
+    for _ in range(60):
+        try:
+            MySQLdb.connect(host=dsn['host'], port=port, user='root', passwd='').close()
+            return proc, dsn
+        except MySQLdb.Error:
+            time.sleep(0.5)
+    proc.terminate()
+    LOGGER.critical("Local database server did not start")
+    sys.exit(-1)
+
+
+def parse_dsn(dsn):
+    """ Parse user:password@host:port
+        Keyword arguments:
+          dsn: connection string
+        Returns:
+          Connection parameters
+    """
+    credentials, _, address = dsn.rpartition('@')
+    user, _, password = credentials.partition(':')
+    host, _, port = address.partition(':')
+    return {'host': host or '127.0.0.1', 'port': int(port or 3306),
+            'user': user or 'root', 'password': password}
+
+
+def sql_statements(text):
+    """ Split a SQL script into statements, honoring DELIMITER lines
+        Keyword arguments:
+          text: SQL script
+        Returns:
+          Generator of statements
+    """
+    delimiter = ';'
+    buf = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped.upper().startswith('DELIMITER'):
+            delimiter = stripped.split()[1]
+            continue
+        if not buf and (not stripped or stripped.startswith('--')):
+            continue
+        buf.append(line)
+        if stripped.endswith(delimiter):
+            statement = '\n'.join(buf).rstrip()[:-len(delimiter)].strip()
+            buf = []
+            if statement:
+                yield statement
+
+
+def load_databases(conn, data):
+    """ (Re)create the benchmark databases and load them
+        Keyword arguments:
+          conn: server connection
+          data: fixture data from fixtures.generate
+        Returns:
+          None
+    """
+    cursor = conn.cursor()
+    for source, dbname in DATABASE.items():
+        cursor.execute(f"DROP DATABASE IF EXISTS {dbname}")
+        cursor.execute(f"CREATE DATABASE {dbname}")
+        cursor.execute(f"USE {dbname}")
+        for path in SCHEMA[source]:
+            with open(path, 'r', encoding='utf-8') as instream:
+                for statement in sql_statements(instream.read()):
+                    cursor.execute(statement)
+        for name, tbl in data[source].items():
+            sql = f"INSERT INTO {name} ({','.join(tbl['columns'])}) VALUES " \
+                  + f"({','.join(['%s'] * len(tbl['columns']))})"
+            for idx in range(0, len(tbl['rows']), INSERT_CHUNK):
+                cursor.executemany(sql, tbl['rows'][idx:idx + INSERT_CHUNK])
+    conn.commit()
+    cursor.close()
+
+
+def server_status(conn):
+    """ Return the server statement counters
+        Keyword arguments:
+          conn: server connection
+        Returns:
+          Dictionary of counter: value
+    """
+    cursor = conn.cursor()
+    cursor.execute("SHOW GLOBAL STATUS WHERE Variable_name IN (%s)"
+                   % ','.join(['%s'] * len(STATUS)), STATUS)
+    status = {name: int(value) for name, value in cursor.fetchall()}
+    cursor.close()
+    return status
+
+
+def run_sync(script, args, stub, workdir):
+    """ Run one sync program against the local server and stub
+        Keyword arguments:
+          script: program name
+          args: program arguments
+          stub: StubServer
+          workdir: working directory
+        Returns:
+          elapsed seconds, completed process, program metrics
+    """
+    metrics = os.path.join(workdir, script.replace('.py', '.metrics.json'))
+    if os.path.exists(metrics):
+        os.remove(metrics)
+    # Each scale has its own stub on a new port, so every run starts with an
+    # empty config cache rather than URLs cached from an earlier stub
+    cache = os.path.join(workdir, 'config_cache')
+    shutil.rmtree(cache, ignore_errors=True)
+    env = dict(os.environ, FLYCORE_CONFIG_URL=stub.url, FLYCORE_CONFIG_CACHE=cache,
+               PYTHONPATH=os.pathsep.join(filter(None, [BIN, os.environ.get('PYTHONPATH')])))
+    cmd = [sys.executable, os.path.join(BIN, script), '--manifold', MANIFOLD,
+           '--metrics', metrics, *args]
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=workdir, env=env, capture_output=True, text=True,
+                          check=False)
+    elapsed = time.perf_counter() - start
+    try:
+        with open(metrics, 'r', encoding='utf-8') as instream:
+            return elapsed, proc, json.load(instream)
+    except (OSError, ValueError):
+        return elapsed, proc, {}
+
+
+def benchmark_scale(conn, dsn, scale, workdir):
+    """ Benchmark every sync at one scale factor
+        Keyword arguments:
+          conn: server connection
+          dsn: connection parameters
+          scale: scale factor
+          workdir: working directory
+        Returns:
+          List of result dictionaries
+    """
+    data = fixtures.generate(scale, ARG.SEED)
+    payloads = data['flycore']
+    if ARG.RESPONSES:
+        payloads.update(stub_server.load_responses(ARG.RESPONSES))
+    db_config = {source: {MANIFOLD: dict(dsn, name=dbname)}
+                 for source, dbname in DATABASE.items()}
+    stub = stub_server.start_stub(payloads, db_config)
+    results = []
+    for script, args in SYNCS:
+        if ARG.SCRIPTS and script not in ARG.SCRIPTS:
+            continue
+        times = []
+        for _ in range(ARG.RUNS):
+            load_databases(conn, data)
+            stub.reset_stats()
+            before = server_status(conn)
+            elapsed, proc, metrics = run_sync(script, args, stub, workdir)
+            after = server_status(conn)
+            times.append(elapsed)
+            if proc.returncode:
+                LOGGER.error("%s exited with %d: %s", script, proc.returncode,
+                             proc.stderr.strip()[-500:])
+                break
+        # The closing SHOW GLOBAL STATUS counts as one question
+        queries = {name: after[name] - before[name] for name in STATUS}
+        queries['Questions'] -= 1
+        http = stub.get_stats()
+        result = {'scale': scale, 'script': script, 'returncode': proc.returncode,
+                  'seconds': round(statistics.median(times), 3), 'queries': queries,
+                  'http_calls': http['calls'], 'http_bytes': http['bytes'],
+                  'http_requests': http['requests'], 'phases': metrics.get('phases', {}),
+                  'statements': metrics.get('sql', {})}
+        print(f"x{scale:<6g} {script:32} {result['seconds']:8.3f}s "
+              f"queries {queries['Questions']:8d} http {http['calls']:7d} "
+              f"({http['bytes']} bytes)")
+        results.append(result)
+    stub.shutdown()
+    return results
+
+
+def run_benchmarks():
+    """ Set up the database server and run the benchmarks
+        Keyword arguments:
+          None
+        Returns:
+          List of result dictionaries
+    """
+    workdir = tempfile.mkdtemp(prefix='flycore_bench_')
+    proc = None
+    if ARG.MYSQL:
+        dsn = parse_dsn(ARG.MYSQL)
+    else:
+        proc, dsn = start_mysqld(workdir)
+    try:
+        conn = MySQLdb.connect(host=dsn['host'], port=dsn['port'], user=dsn['user'],
+                               passwd=dsn['password'])
+        results = []
+        for scale in ARG.SCALE:
+            results.extend(benchmark_scale(conn, dsn, scale, workdir))
+        conn.close()
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+        if not ARG.KEEP:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(
+        description="Time the FLYF2 syncs offline against synthetic data")
+    PARSER.add_argument('scripts', nargs='*', metavar='SCRIPT',
+                        help='Syncs to run (default: all)')
+    PARSER.add_argument('--scale', dest='SCALE', type=float, nargs='+', default=[1, 10],
+                        help='Scale factors [1 10]')
+    PARSER.add_argument('--seed', dest='SEED', type=int, default=0, help='Random seed')
+    PARSER.add_argument('--runs', dest='RUNS', type=int, default=1,
+                        help='Runs per sync and scale (median is reported)')
+    PARSER.add_argument('--mysql', dest='MYSQL', action='store',
+                        help='Use an existing server (user:password@host:port) '
+                             + 'instead of starting one')
+    PARSER.add_argument('--responses', dest='RESPONSES', action='store',
+                        help='Directory of recorded <request>.json FLYF2 responses')
+    PARSER.add_argument('--output', dest='OUTPUT', action='store',
+                        help='Write results to this JSON file')
+    PARSER.add_argument('--keep', dest='KEEP', action='store_true', default=False,
+                        help='Keep the working directory')
+    ARG = PARSER.parse_args()
+    ARG.SCRIPTS = ARG.scripts
+    logging.basicConfig(format='%(levelname)s: %(message)s')
+    RESULTS = run_benchmarks()
+    if ARG.OUTPUT:
+        with open(ARG.OUTPUT, 'w', encoding='utf-8') as outstream:
+            json.dump(RESULTS, outstream, indent=2)
+    sys.exit(0)
@@ -0,0 +1,32 @@
+-- Minimal FlyBoy schema for the offline benchmarks. The copy tray columns on
+-- __flipper_flystocks_stock are added afterwards from
+-- sql/flipper_stock_tray_columns.sql, as in production.
+
+CREATE TABLE StockFinder (
+  __kp_UniqueID INT NOT NULL PRIMARY KEY,
+  RobotID INT,
+  Stock_Name VARCHAR(255),
+  Genotype TEXT,
+  Lab_ID VARCHAR(64),
+  KEY stockfinder_robotid_ind (RobotID)
+) ENGINE=InnoDB;
+
+CREATE TABLE __flipper_flystocks_stock (
+  stock_id INT NOT NULL PRIMARY KEY,
+  genotype TEXT,
+  rack_location VARCHAR(64),
+  cell INT,
+  last_flipped DATETIME,
+  rack VARCHAR(16),
+  rack_location_b VARCHAR(64),
+  cell_b INT,
+  last_flipped_b DATETIME,
+  rack_b VARCHAR(16)
+) ENGINE=InnoDB;
+
+CREATE TABLE doi_data (
+  doi VARCHAR(128) NOT NULL PRIMARY KEY,
+  title TEXT,
+  first_author VARCHAR(255),
+  publication_date VARCHAR(32)
+) ENGINE=InnoDB;
@@ -0,0 +1,111 @@
+-- Minimal SAGE schema for the offline benchmarks: the tables, views, function
+-- and procedure used by the FLYF2 -> SAGE sync programs.
+
+CREATE TABLE cv (
+  id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+  name VARCHAR(255) NOT NULL,
+  UNIQUE KEY cv_name_uk_ind (name)
+) ENGINE=InnoDB;
+
+CREATE TABLE cv_term (
+  id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+  cv_id INT NOT NULL,
+  name VARCHAR(255) NOT NULL,
+  UNIQUE KEY cv_term_name_uk_ind (cv_id,name)
+) ENGINE=InnoDB;
+
+CREATE TABLE line (
+  id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+  name VARCHAR(255) NOT NULL,
+  lab_id INT NOT NULL,
+  organism_id INT NOT NULL DEFAULT 1,
+  create_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  UNIQUE KEY line_name_uk_ind (name)
+) ENGINE=InnoDB;
+
+CREATE TABLE line_property (
+  id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+  line_id INT NOT NULL,
+  type_id INT NOT NULL,
+  value TEXT,
+  create_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  UNIQUE KEY line_property_type_uk_ind (line_id,type_id),
+  KEY line_property_type_ind (type_id)
+) ENGINE=InnoDB;
+
+CREATE TABLE line_relationship (
+  id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+  subject_id INT NOT NULL,
+  type_id INT NOT NULL,
+  object_id INT NOT NULL,
+  UNIQUE KEY line_relationship_uk_ind (subject_id,type_id,object_id),
+  KEY line_relationship_object_ind (object_id)
+) ENGINE=InnoDB;
+
+CREATE TABLE line_event (
+  id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+  line_id INT NOT NULL,
+  KEY line_event_line_ind (line_id)
+) ENGINE=InnoDB;
+
+CREATE TABLE publishing_name (
+  id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+  line_id INT NOT NULL,
+  source_id INT,
+  publishing_name VARCHAR(255) NOT NULL,
+  for_publishing TINYINT NOT NULL DEFAULT 0,
+  published TINYINT NOT NULL DEFAULT 0,
+  label TINYINT NOT NULL DEFAULT 0,
+  display_genotype TINYINT NOT NULL DEFAULT 0,
+  requester VARCHAR(255),
+  notes TEXT,
+  source_create_date DATETIME,
+  preferred_name TINYINT NOT NULL DEFAULT 0,
+  create_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  UNIQUE KEY publishing_name_uk_ind (line_id,publishing_name),
+  UNIQUE KEY publishing_name_source_uk_ind (source_id)
+) ENGINE=InnoDB;
+
+CREATE VIEW line_vw AS
+  SELECT l.id,l.name,lab.name AS lab,fc.value AS flycore_id
+  FROM line l
+  JOIN cv_term lab ON (lab.id=l.lab_id)
+  LEFT JOIN line_property fc ON (fc.line_id=l.id AND fc.type_id=
+    (SELECT t.id FROM cv_term t JOIN cv c ON (c.id=t.cv_id)
+     WHERE c.name='line' AND t.name='flycore_id'));
+
+CREATE VIEW line_relationship_vw AS
+  SELECT s.name AS subject,t.name AS relationship,o.name AS object,
+         lr.subject_id,lr.object_id
+  FROM line_relationship lr
+  JOIN line s ON (s.id=lr.subject_id)
+  JOIN line o ON (o.id=lr.object_id)
+  JOIN cv_term t ON (t.id=lr.type_id);
+
+CREATE VIEW publishing_name_vw AS
+  SELECT pn.id,pn.source_id,l.name AS line,pn.publishing_name,pn.for_publishing,
+         pn.published,pn.label,pn.display_genotype,pn.requester,pn.notes,
+         pn.source_create_date,pn.preferred_name
+  FROM publishing_name pn
+  JOIN line l ON (l.id=pn.line_id);
+
+DELIMITER //
+CREATE FUNCTION getCvTermId(cv_name VARCHAR(255),term_name VARCHAR(255),
+                            definition VARCHAR(255)) RETURNS INT
+  READS SQL DATA
+BEGIN
+  DECLARE term_id INT;
+  SELECT t.id INTO term_id FROM cv_term t JOIN cv c ON (c.id=t.cv_id)
+    WHERE c.name=cv_name AND t.name=term_name;
+  RETURN term_id;
+END //
+
+CREATE PROCEDURE createLineRelationship(IN child_id INT,IN parent_id INT)
+  MODIFIES SQL DATA
+BEGIN
+  INSERT IGNORE INTO line_relationship (subject_id,type_id,object_id)
+    VALUES (child_id,getCvTermId('relationship','child_of',''),parent_id);
+  INSERT IGNORE INTO line_relationship (subject_id,type_id,object_id)
+    VALUES (parent_id,getCvTermId('relationship','parent_of',''),child_id);
+END //
+DELIMITER ;
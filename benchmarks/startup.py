@@ -0,0 +1,119 @@
+''' startup.py
+    Measure cold-start time of the bin/ programs, and optionally summarize
+    per-module import time (python -X importtime) for each of them.
+'''
+import argparse
+import glob
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin')
+# Modules that are imported by other programs rather than run
+LIBRARIES = ['flycore_common.py']
+LOGGER = logging.getLogger(__name__)
+
+
+def get_scripts():
+    """ Get the programs to measure
+        Keyword arguments:
+          None
+        Returns:
+          List of script paths
+    """
+    if ARG.SCRIPTS:
+        return [os.path.join(BIN, os.path.basename(scr)) for scr in ARG.SCRIPTS]
+    return [scr for scr in sorted(glob.glob(os.path.join(BIN, '*.py')))
+            if os.path.basename(scr) not in LIBRARIES]
+
+
+def run_script(script, importtime=False):
+    """ Start a program in a fresh interpreter and exit right after argument parsing
+        Keyword arguments:
+          script: script path
+          importtime: collect -X importtime output
+        Returns:
+          elapsed seconds, completed process
+    """
+    cmd = [sys.executable]
+    if importtime:
+        cmd.extend(['-X', 'importtime'])
+    cmd.extend([script, '--help'])
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=BIN, capture_output=True, text=True, check=False)
+    return time.perf_counter() - start, proc
+
+
+def parse_importtime(stderr):
+    """ Summarize -X importtime output by top-level package
+        Keyword arguments:
+          stderr: interpreter standard error
+        Returns:
+          Dictionary of top-level package: self time (ms)
+    """
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        selftime, _, name = line[len('import time:'):].split('|')
+        top = name.strip().split('.')[0]
+        packages[top] = packages.get(top, 0) + int(selftime) / 1000
+    return packages
+
+
+def profile_script(script):
+    """ Time a program's startup, and summarize its imports if requested
+        Keyword arguments:
+          script: script path
+        Returns:
+          Result dictionary
+    """
+    name = os.path.basename(script)
+    times = []
+    for _ in range(ARG.RUNS):
+        elapsed, proc = run_script(script)
+        if proc.returncode:
+            LOGGER.error("%s did not start: %s", name,
+                         proc.stderr.strip().splitlines()[-1] if proc.stderr else proc.returncode)
+            return {'script': name, 'error': True}
+        times.append(elapsed * 1000)
+    result = {'script': name, 'min_ms': round(min(times), 1),
+              'median_ms': round(statistics.median(times), 1)}
+    print(f"{name:32} min {result['min_ms']:8.1f} ms  median {result['median_ms']:8.1f} ms")
+    if ARG.PROFILE:
+        _, proc = run_script(script, importtime=True)
+        packages = parse_importtime(proc.stderr)
+        top = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:ARG.TOP]
+        result['imports_ms'] = {pkg: round(msec, 1) for pkg, msec in top}
+        result['imports_total_ms'] = round(sum(packages.values()), 1)
+        print(f"  imports: {result['imports_total_ms']:.1f} ms")
+        for pkg, msec in top:
+            print(f"    {pkg:28} {msec:8.1f} ms")
+    return result
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(
+        description="Measure cold-start time of the bin/ programs")
+    PARSER.add_argument('scripts', nargs='*', metavar='SCRIPT',
+                        help='Programs to measure (default: all)')
+    PARSER.add_argument('--runs', dest='RUNS', type=int, default=5,
+                        help='Interpreter starts per program')
+    PARSER.add_argument('--profile-startup', dest='PROFILE', action='store_true',
+                        default=False, help='Summarize per-package import time')
+    PARSER.add_argument('--top', dest='TOP', type=int, default=10,
+                        help='Packages to show with --profile-startup')
+    PARSER.add_argument('--output', dest='OUTPUT', action='store',
+                        help='Write results to this JSON file')
+    ARG = PARSER.parse_args()
+    ARG.SCRIPTS = ARG.scripts
+    logging.basicConfig(format='%(levelname)s: %(message)s')
+    RESULTS = [profile_script(scr) for scr in get_scripts()]
+    if ARG.OUTPUT:
+        with open(ARG.OUTPUT, 'w', encoding='utf-8') as outstream:
+            json.dump(RESULTS, outstream, indent=2)
+    sys.exit(0)
@@ -0,0 +1,167 @@
+''' stub_server.py
+    Local stand-in for the config service and the FLYF2 (flycore) responder.
+    Serves generated or recorded ?request= payloads and counts calls and bytes.
+'''
+import argparse
+import glob
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import threading
+from urllib.parse import parse_qsl, urlsplit
+import fixtures
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """ Route GET requests to config or flycore payloads """
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def send_json(self, data, status=200):
+        """ Send a JSON response
+            Keyword arguments:
+              data: response
+              status: HTTP status
+            Returns:
+              Body length
+        """
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return len(body)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """ Handle a GET request """
+        url = urlsplit(self.path)
+        server = self.server
+        if url.path == '/_stats':
+            self.send_json(server.get_stats())
+            return
+        if url.path == '/_reset':
+            server.reset_stats()
+            self.send_json({})
+            return
+        if url.path == '/config/db_config':
+            name, data = 'db_config', {'config': server.db_config}
+        elif url.path == '/config/rest_services':
+            name, data = 'rest_services', {'config': {'config': {'url': server.url},
+                                                      'flycore': {'url': server.url
+                                                                  + 'flycore/'}}}
+        elif url.path.rstrip('/') == '/flycore':
+            name, data = self.flycore_payload(url.query)
+        else:
+            name, data = url.path, None
+        if data is None:
+            size = self.send_json({'error': f"No payload for {self.path}"}, 404)
+        else:
+            size = self.send_json(data)
+        server.count(name, size)
+
+    def flycore_payload(self, query):
+        """ Find the payload for a flycore ?request= query
+            Keyword arguments:
+              query: URL query string
+            Returns:
+              request name, payload (None if unknown)
+        """
+        params = dict(parse_qsl(query.replace(';', '&')))
+        name = params.get('request', '')
+        payload = self.server.payloads.get(name)
+        if isinstance(payload, dict) and 'by' in payload and 'responses' in payload:
+            payload = payload['responses'].get(params.get(payload['by']),
+                                               payload.get('default'))
+        return name, payload
+
+
+class StubServer(ThreadingHTTPServer):
+    """ HTTP server holding payloads and call statistics """
+    daemon_threads = True
+
+    def __init__(self, address, payloads, db_config):
+        super().__init__(address, StubHandler)
+        self.payloads = payloads
+        self.db_config = db_config
+        self.url = f"http://{self.server_address[0]}:{self.server_address[1]}/"
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.reset_stats()
+
+    def count(self, name, size):
+        """ Count a call
+            Keyword arguments:
+              name: request name
+              size: response bytes
+            Returns:
+              None
+        """
+        with self.lock:
+            self.stats['calls'] += 1
+            self.stats['bytes'] += size
+            self.stats['requests'][name] = self.stats['requests'].get(name, 0) + 1
+
+    def get_stats(self):
+        """ Return a copy of the call statistics """
+        with self.lock:
+            return json.loads(json.dumps(self.stats))
+
+    def reset_stats(self):
+        """ Reset the call statistics """
+        with self.lock:
+            self.stats = {'calls': 0, 'bytes': 0, 'requests': {}}
+
+
+def load_responses(directory):
+    """ Load recorded responses (one <request>.json file per request name)
+        Keyword arguments:
+          directory: response directory
+        Returns:
+          Dictionary of request name: payload
+    """
+    responses = {}
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        with open(path, 'r', encoding='utf-8') as instream:
+            responses[os.path.splitext(os.path.basename(path))[0]] = json.load(instream)
+    return responses
+
+
+def start_stub(payloads, db_config, host='127.0.0.1', port=0):
+    """ Start the stub in a background thread
+        Keyword arguments:
+          payloads: dictionary of request name: payload
+          db_config: config/db_config contents
+          host: listen address
+          port: listen port (0 for any free port)
+        Returns:
+          StubServer
+    """
+    server = StubServer((host, port), payloads, db_config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(
+        description="Serve config and FLYF2 payloads for offline runs")
+    PARSER.add_argument('--port', dest='PORT', type=int, default=8080, help='Listen port')
+    PARSER.add_argument('--scale', dest='SCALE', type=float, default=1,
+                        help='Scale factor for generated payloads')
+    PARSER.add_argument('--seed', dest='SEED', type=int, default=0, help='Random seed')
+    PARSER.add_argument('--responses', dest='RESPONSES', action='store',
+                        help='Directory of recorded <request>.json responses')
+    PARSER.add_argument('--db_config', dest='DBCONFIG', action='store',
+                        help='JSON file with config/db_config contents')
+    ARG = PARSER.parse_args()
+    PAYLOADS = fixtures.generate(ARG.SCALE, ARG.SEED)['flycore']
+    if ARG.RESPONSES:
+        PAYLOADS.update(load_responses(ARG.RESPONSES))
+    DBCONFIG = {}
+    if ARG.DBCONFIG:
+        with open(ARG.DBCONFIG, 'r', encoding='utf-8') as dbstream:
+            DBCONFIG = json.load(dbstream)
+    SERVER = StubServer(('127.0.0.1', ARG.PORT), PAYLOADS, DBCONFIG)
+    print(f"Serving on {SERVER.url}")
+    SERVER.serve_forever()
@@ -2,27 +2,46 @@
     Add initial splits to publishing_name table for a release
 '''
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from operator import attrgetter
 import os
 import re
+import sqlite3
 import sys
+import time
 import MySQLdb
 import requests
-from simple_term_menu import TerminalMenu
-from tqdm import tqdm
 from jrc_common import jrc_common as JRC
 
 # Databases
 DB = {}
-READ = {"PN": "SELECT publishing_name FROM publishing_name_vw WHERE line=%s AND "
-              + "publishing_name=%s",
-        "LID": "SELECT id FROM line WHERE name=%s",
+READ = {"RELEASES": "SELECT DISTINCT value FROM image_property_vw WHERE type='alps_release' "
+                    + "AND value != '' ORDER BY 1",
+        "PN": "SELECT line,publishing_name FROM publishing_name_vw WHERE line IN (%s)",
+        "LID": "SELECT name,id FROM line WHERE name IN (%s)",
        }
 WRITE = {"NAME": "INSERT INTO publishing_name (publishing_name,line_id,for_publishing,published,"
-                 + "display_genotype,requester,notes,preferred_name) VALUES (%s,%s,1,1,0,'',%s,1)",
+                 + "display_genotype,requester,notes,preferred_name) VALUES %s",
+         "NAMEROW": "(%s,%s,1,1,0,'',%s,1)",
         }
+# Number of lines per query/insert
+SQL_CHUNK = 1000
+# Local cache of the ALPS release catalog and sample -> line mappings
+# (samples are immutable, so the sample table is append-only)
+CACHE = {"CREATE": ["CREATE TABLE IF NOT EXISTS sample (sample_id TEXT PRIMARY KEY,line TEXT)",
+                    "CREATE TABLE IF NOT EXISTS release_catalog (name TEXT PRIMARY KEY,"
+                    + "updated REAL)"],
+         "RELEASES": "SELECT name,updated FROM release_catalog ORDER BY name",
+         "DELRELEASES": "DELETE FROM release_catalog",
+         "INSRELEASE": "INSERT INTO release_catalog (name,updated) VALUES (?,?)",
+         "READ": "SELECT sample_id,line FROM sample WHERE sample_id IN ({samples})",
+         "INSERT": "INSERT OR IGNORE INTO sample (sample_id,line) VALUES (?,?)",
+         "EVICT": "DELETE FROM sample WHERE rowid <= (SELECT MAX(rowid) FROM sample) - ?",
+        }
+CACHE_CHUNK = 500
 # General
-COUNT = {"lines": 0, "inserted": 0}
+COUNT = {"lines": 0, "inserted": 0, "cached": 0}
+SESSION = requests.Session()
 
 def terminate_program(msg=None):
     """ Log an optional error to output, close files, and exit
@@ -36,6 +55,55 @@ def terminate_program(msg=None):
     sys.exit(-1 if msg else 0)
 
 
+def open_cache():
+    """ Open the local cache
+        Keyword arguments:
+          None
+        Returns:
+          SQLite connection
+    """
+    try:
+        conn = sqlite3.connect(ARG.CACHE)
+        for stmt in CACHE['CREATE']:
+            conn.execute(stmt)
+    except sqlite3.Error as err:
+        terminate_program(f"Could not open cache {ARG.CACHE}: {err}")
+    return conn
+
+
+def get_releases():
+    """ Get the ALPS release catalog, from the cache if it is recent enough
+        Keyword arguments:
+          None
+        Returns:
+          List of releases
+    """
+    conn = open_cache()
+    try:
+        rows = conn.execute(CACHE['RELEASES']).fetchall()
+    except sqlite3.Error as err:
+        terminate_program(f"Could not read cache {ARG.CACHE}: {err}")
+    if rows and (time.time() - rows[0][1] < ARG.RELEASE_TTL * 3600):
+        LOGGER.info("Found %d releases in cache", len(rows))
+        conn.close()
+        return [row[0] for row in rows]
+    try:
+        DB['sage']["cursor"].execute(READ['RELEASES'])
+        rows = DB['sage']["cursor"].fetchall()
+    except MySQLdb.Error as err:
+        terminate_program(JRC.sql_error(err))
+    rlist = [row['value'] for row in rows]
+    now = time.time()
+    try:
+        conn.execute(CACHE['DELRELEASES'])
+        conn.executemany(CACHE['INSRELEASE'], [(rel, now) for rel in rlist])
+        conn.commit()
+    except sqlite3.Error as err:
+        terminate_program(f"Could not write cache {ARG.CACHE}: {err}")
+    conn.close()
+    return rlist
+
+
 def initialize_program():
     """ Initialize the program
         Keyword arguments:
@@ -56,13 +124,8 @@ def initialize_program():
     except Exception as err:
         terminate_program(err)
     if not ARG.RELEASE:
-        try:
-            DB['sage']["cursor"].execute("SELECT DISTINCT value FROM image_property_vw " \
-                                         + "WHERE type='alps_release' AND value != '' ORDER BY 1")
-            rows = DB['sage']["cursor"].fetchall()
-        except MySQLdb.Error as err:
-            terminate_program(JRC.sql_error(err))
-        rlist = [row['value'] for row in rows]
+        from simple_term_menu import TerminalMenu  # pylint: disable=import-outside-toplevel
+        rlist = get_releases()
         terminal_menu = TerminalMenu(rlist, title="Select a release:")
         chosen = terminal_menu.show()
         if chosen is None:
@@ -85,9 +148,9 @@ def call_responder(server, endpoint, authenticate=False):
         if authenticate:
             headers = {"Content-Type": "application/json",
                        "Authorization": "Bearer " + os.environ["NEUPRINT_JWT"]}
-            req = requests.get(url, headers=headers, timeout=10)
+            req = SESSION.get(url, headers=headers, timeout=10)
         else:
-            req = requests.get(url, timeout=10)
+            req = SESSION.get(url, timeout=10)
     except requests.exceptions.RequestException as err:
         terminate_program(err)
     if req.status_code == 200:
@@ -95,6 +158,64 @@ def call_responder(server, endpoint, authenticate=False):
     terminate_program(f"Status: {str(req.status_code)}")
 
 
+def get_sample_line(sample):
+    """ Get the line for a sample
+        Keyword arguments:
+          sample: sample ID ("Sample#nnn")
+        Returns:
+          Line name
+    """
+    response = call_responder('jacs', 'data/sample?sampleId=' + sample.replace("Sample#", ""))
+    return response[0]['line']
+
+
+def get_cached_lines(conn, samples):
+    """ Get lines for samples that are already in the cache
+        Keyword arguments:
+          conn: SQLite connection
+          samples: list of sample IDs
+        Returns:
+          Dictionary of lines keyed by sample ID
+    """
+    cached = {}
+    try:
+        for idx in range(0, len(samples), CACHE_CHUNK):
+            chunk = samples[idx:idx + CACHE_CHUNK]
+            sql = CACHE['READ'].format(samples=','.join(['?'] * len(chunk)))
+            cached.update(conn.execute(sql, chunk).fetchall())
+    except sqlite3.Error as err:
+        terminate_program(f"Could not read cache {ARG.CACHE}: {err}")
+    return cached
+
+
+def cache_lines(conn, sample_lines):
+    """ Add sample lines to the cache, and evict the oldest entries if it's too large
+        Keyword arguments:
+          conn: SQLite connection
+          sample_lines: dictionary of lines keyed by sample ID
+        Returns:
+          None
+    """
+    try:
+        conn.executemany(CACHE['INSERT'], sample_lines.items())
+        if ARG.CACHE_SIZE:
+            conn.execute(CACHE['EVICT'], (ARG.CACHE_SIZE,))
+        conn.commit()
+    except sqlite3.Error as err:
+        terminate_program(f"Could not write cache {ARG.CACHE}: {err}")
+
+
+def collation_key(name):
+    """ Return a key that compares the way SAGE's case-insensitive, PAD SPACE
+        collation compares names
+        Keyword arguments:
+          name: line or publishing name
+        Returns:
+          Normalized name
+    """
+    return name.rstrip(' ').casefold()
+
+
 def add_is_lines():
     """ Add initial splits for a release
         Keyword arguments:
@@ -102,37 +223,68 @@ def add_is_lines():
         Returns:
           None
     """
+    from tqdm import tqdm  # pylint: disable=import-outside-toplevel
     samples = call_responder('jacs', 'process/release/' + ARG.RELEASE)
     LOGGER.info("Samples: %d", len(samples[0]['children']))
+    children = samples[0]['children']
+    conn = open_cache()
+    sample_lines = get_cached_lines(conn, children)
+    COUNT['cached'] = len(sample_lines)
+    missing = [smp for smp in children if smp not in sample_lines]
+    LOGGER.info("Samples found in cache: %d", COUNT['cached'])
+    fetched = {}
+    with ThreadPoolExecutor(max_workers=ARG.THREADS) as executor:
+        for smp, line in tqdm(zip(missing, executor.map(get_sample_line, missing)),
+                              total=len(missing), desc='Getting lines'):
+            fetched[smp] = line
+    cache_lines(conn, fetched)
+    conn.close()
+    sample_lines.update(fetched)
     lines = {}
-    for smp in tqdm(samples[0]['children'], desc='Getting lines'):
-        response = call_responder('jacs', 'data/sample?sampleId=' + smp.replace("Sample#", ""))
-        if re.search(r"_I[SL]\d+", response[0]['line']):
-            lines[response[0]['line']] = True
+    for smp in children:
+        if re.search(r"_I[SL]\d+", sample_lines[smp]):
+            lines[sample_lines[smp]] = True
     LOGGER.info("Lines: %d", len(lines))
     COUNT['lines'] = len(lines)
-    for line in tqdm(lines, desc='Inserting names'):
+    lines = list(lines)
+    existing = {}
+    line_id = {}
+    for idx in range(0, len(lines), SQL_CHUNK):
+        chunk = lines[idx:idx + SQL_CHUNK]
+        placeholders = ','.join(['%s'] * len(chunk))
+        try:
+            DB['sage']["cursor"].execute(READ['PN'] % placeholders, chunk)
+            for row in DB['sage']["cursor"].fetchall():
+                existing[(collation_key(row['line']),
+                          collation_key(row['publishing_name']))] = True
+            DB['sage']["cursor"].execute(READ['LID'] % placeholders, chunk)
+            for row in DB['sage']["cursor"].fetchall():
+                line_id[collation_key(row['name'])] = row['id']
+        except MySQLdb.Error as err:
+            terminate_program(JRC.sql_error(err))
+    insert = []
+    for line in lines:
         pname = re.sub(r"^[A-Z0-9]+_", "", line)
+        key = (collation_key(line), collation_key(pname))
+        if key in existing:
+            continue
+        if key[0] not in line_id:
+            LOGGER.error("Could not find %s in line table", line)
+            continue
+        # Lines that differ only by case or trailing spaces get one name
+        existing[key] = True
+        insert.append((pname, line_id[key[0]], ARG.RELEASE))
+    for idx in tqdm(range(0, len(insert), SQL_CHUNK), desc='Inserting names'):
+        chunk = insert[idx:idx + SQL_CHUNK]
+        sql = WRITE['NAME'] % ','.join([WRITE['NAMEROW']] * len(chunk))
         try:
-            DB['sage']["cursor"].execute(READ['PN'], (line, pname))
-            rows = DB['sage']["cursor"].fetchall()
+            DB['sage']["cursor"].execute(sql, [val for row in chunk for val in row])
         except MySQLdb.Error as err:
             terminate_program(JRC.sql_error(err))
-        if not rows:
-            try:
-                DB['sage']["cursor"].execute(READ['LID'], (line,))
-                lid = DB['sage']["cursor"].fetchone()
-            except MySQLdb.Error as err:
-                terminate_program(JRC.sql_error(err))
-            if not lid:
-                LOGGER.error("Could not find %s in line table", line)
-                continue
-            try:
-                DB['sage']["cursor"].execute(WRITE['NAME'], (pname, lid['id'], ARG.RELEASE))
-            except MySQLdb.Error as err:
-                terminate_program(JRC.sql_error(err))
-            COUNT['inserted'] += 1
-            LOGGER.debug("Inserted %s", pname)
+        COUNT['inserted'] += len(chunk)
+        for row in chunk:
+            LOGGER.debug("Inserted %s", row[0])
+    print(f"Cached samples: {COUNT['cached']}")
     print(f"Lines found:    {COUNT['lines']}")
     print(f"Names inserted: {COUNT['inserted']}")
     if ARG.WRITE:
@@ -147,6 +299,15 @@ if __name__ == '__main__':
                         default='prod', choices=['dev', 'prod'], help='manifold')
     PARSER.add_argument('--release', dest='RELEASE', action='store',
                         help='ALPS release')
+    PARSER.add_argument('--threads', dest='THREADS', action='store', type=int,
+                        default=16, help='Number of concurrent JACS requests [16]')
+    PARSER.add_argument('--cache', dest='CACHE', action='store',
+                        default='sample_line_cache.db',
+                        help='Release catalog and sample to line cache file')
+    PARSER.add_argument('--release_ttl', dest='RELEASE_TTL', action='store', type=float,
+                        default=24, help='Hours to cache the release catalog [24]')
+    PARSER.add_argument('--cache_size', dest='CACHE_SIZE', action='store', type=int,
+                        default=0, help='Maximum number of cached samples [unlimited]')
     PARSER.add_argument('--write', dest='WRITE', action='store_true',
                         default=False, help='Actually write to database')
     PARSER.add_argument('--verbose', dest='VERBOSE', action='store_true',
@@ -156,6 +317,8 @@ if __name__ == '__main__':
     ARG = PARSER.parse_args()
     LOGGER = JRC.setup_logging(ARG)
     REST = JRC.get_config("rest_services")
+    SESSION.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=ARG.THREADS))
+    SESSION.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=ARG.THREADS))
     initialize_program()
     add_is_lines()
     terminate_program()
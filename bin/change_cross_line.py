@@ -3,14 +3,14 @@ import json
 import select
 import sys
 import colorlog
-import requests
 import MySQLdb
+import flycore_common as FC
 
 # Database
-READ = {'crosses': "SELECT cross_type FROM cross_event_vw WHERE cross_barcode=%s",
+READ = {'crosses': "SELECT cross_barcode,cross_type FROM cross_event_vw WHERE cross_barcode IN (%s)",
         'main': "SELECT id FROM line WHERE name=%s",
-        'limages': "SELECT line, id FROM image_data_mv WHERE cross_barcode=%s",
-        'lassays': "SELECT line,sessions FROM line_summary_vw WHERE line=%s"
+        'limages': "SELECT cross_barcode,line,id FROM image_data_mv WHERE cross_barcode IN (%s)",
+        'lassays': "SELECT line,sessions FROM line_summary_vw WHERE line IN (%s)"
        }
 WRITE = {'publishing': "DELETE FROM publishing_name WHERE line_id=%s",
          'relationship': "DELETE FROM line_relationship WHERE subject_id=%s OR object_id=%s",
@@ -18,68 +18,24 @@ WRITE = {'publishing': "DELETE FROM publishing_name WHERE line_id=%s",
          'event': "DELETE FROM line_event WHERE line_id=%s",
          'line': "DELETE FROM line WHERE id=%s",
          'rename': "UPDATE line SET name=%s WHERE id=%s",
-         'relink': "UPDATE image SET line_id=%s WHERE line_id=%s"
+         'relink': "UPDATE image SET line_id=%s WHERE line_id=%s",
+         'relinkimages': "UPDATE image SET line_id=%s WHERE id IN (%s)"
         }
 CONN = dict()
 CURSOR = dict()
+# Image IDs to relink, keyed by new line
+RELINK = dict()
 
 # Configuration
 CONFIG = {'config': {'url': 'http://config.int.janelia.org/'}}
-COUNT = {"deleted": 0, "error": 0, "read": 0, "renamed": 0}
-
-
-def sql_error(err):
-    """ Log a critical SQL error and exit """
-    try:
-        logger.critical('MySQL error [%d]: %s', err.args[0], err.args[1])
-    except IndexError:
-        logger.critical('MySQL error: %s', err)
-    sys.exit(-1)
-
-
-def db_connect(db):
-    """ Connect to a database
-        Keyword arguments:
-        db: database dictionary
-    """
-    logger.debug("Connecting to %s on %s", db['name'], db['host'])
-    try:
-        conn = MySQLdb.connect(host=db['host'], user=db['user'],
-                               passwd=db['password'], db=db['name'])
-    except MySQLdb.Error as err:
-        sql_error(err)
-    try:
-        cursor = conn.cursor()
-        return(conn, cursor)
-    except MySQLdb.Error as err:
-        sql_error(err)
-
-
-def call_responder(server, endpoint):
-    """ Call a responder
-        Keyword arguments:
-        server: server
-        endpoint: REST endpoint
-    """
-    url = CONFIG[server]['url'] + endpoint
-    try:
-        req = requests.get(url)
-    except requests.exceptions.RequestException as err:
-        logger.critical(err)
-        sys.exit(-1)
-    if req.status_code != 200:
-        logger.error('Status: %s', str(req.status_code))
-        sys.exit(-1)
-    return req.json()
+COUNT = {"deleted": 0, "error": 0, "read": 0, "relinked": 0, "renamed": 0}
 
 
 def initialize_program():
     """ Initialize databases """
     global CONFIG
-    dbc = call_responder('config', 'config/db_config')
-    data = dbc['config']
-    (CONN['sage'], CURSOR['sage']) = db_connect(data['sage']['prod'])
-    dbc = call_responder('config', 'config/rest_services')
+    (CONN['sage'], CURSOR['sage']) = FC.connect_database(CONFIG, 'sage', 'prod')
+    dbc = FC.get_config(CONFIG, 'config/rest_services')
     CONFIG = dbc['config']
 
 
@@ -91,7 +47,7 @@ def delete_publishing(line_id):
         if (rowcount):
             logger.debug("Deleted publishing names (%d) for line ID %s" % (rowcount, line_id))
     except MySQLdb.Error as err:
-        sql_error(err)
+        FC.sql_error(err)
 
 
 def delete_relationship(line_id):
@@ -102,7 +58,7 @@ def delete_relationship(line_id):
         if (rowcount):
             logger.debug("Deleted line relationships (%d) for line ID %s" % (rowcount, line_id))
     except MySQLdb.Error as err:
-        sql_error(err)
+        FC.sql_error(err)
 
 
 def delete_event(line_id):
@@ -113,7 +69,7 @@ def delete_event(line_id):
         if (rowcount):
             logger.debug("Deleted line events (%d) for line ID %s" % (rowcount, line_id))
     except MySQLdb.Error as err:
-        sql_error(err)
+        FC.sql_error(err)
 
 
 def delete_lineprop(line_id):
@@ -124,7 +80,7 @@ def delete_lineprop(line_id):
         if (rowcount):
             logger.debug("Deleted line properties (%d) for line ID %s" % (rowcount, line_id))
     except MySQLdb.Error as err:
-        sql_error(err)
+        FC.sql_error(err)
 
 
 def delete_line(line_id):
@@ -138,7 +94,7 @@ def delete_line(line_id):
         if (rowcount):
             logger.debug("Deleted %d line for line ID %s" % (rowcount, line_id))
     except MySQLdb.Error as err:
-        sql_error(err)
+        FC.sql_error(err)
 
 
 def rename_line(line_id, newline):
@@ -146,7 +102,7 @@ def rename_line(line_id, newline):
     try:
         CURSOR['sage'].execute(READ['main'], (newline,))
     except MySQLdb.Error as err:
-        sql_error(err)
+        FC.sql_error(err)
     row = CURSOR['sage'].fetchone()
     if row:
         logger.debug("New line %s is already in SAGE (%s)", newline, row[0])
@@ -158,7 +114,7 @@ def rename_line(line_id, newline):
             if (rowcount):
                 logger.debug("Changed %d images from line ID %s to %s" % (rowcount, old_line_id, line_id))
         except MySQLdb.Error as err:
-            sql_error(err)
+            FC.sql_error(err)
         delete_line(old_line_id)
     else:
         logger.debug(WRITE['rename'] % (newline, line_id))
@@ -168,51 +124,109 @@ def rename_line(line_id, newline):
             if (rowcount):
                 logger.debug("Changed %d line name to %s for line ID %s" % (rowcount, newline, line_id))
         except MySQLdb.Error as err:
-            sql_error(err)
+            FC.sql_error(err)
+
+def chunks(items, size):
+    """ Yield successive chunks of a list
+        Keyword arguments:
+        items: list
+        size: chunk size
+    """
+    for idx in range(0, len(items), size):
+        yield items[idx:idx + size]
+
 
-def process_cross(cross_id, line_id, line, newline):
+def fetch_chunked(key, values):
+    """ Run a READ query for a list of values in chunks
+        Keyword arguments:
+        key: READ key
+        values: list of values for the IN clause
+        Returns list of rows
+    """
+    rows = []
+    for chunk in chunks(values, ARG.CHUNK):
+        sql = READ[key] % ','.join(['%s'] * len(chunk))
+        try:
+            CURSOR['sage'].execute(sql, chunk)
+        except MySQLdb.Error as err:
+            FC.sql_error(err)
+        rows.extend(CURSOR['sage'].fetchall())
+    return rows
+
+
+def preload(crosses):
+    """ Get assays, crosses, and images for every row in the input
+        Keyword arguments:
+        crosses: list of (cross barcode, line ID, line, new line)
+        Returns dictionary of lookup maps
+    """
+    barcodes = list(set([cross[0] for cross in crosses]))
+    lines = list(set([cross[2] for cross in crosses]))
+    index = {'assays': dict(), 'crosses': dict(), 'images': dict()}
+    for row in fetch_chunked('lassays', lines):
+        index['assays'][row[0]] = row[1]
+    for row in fetch_chunked('crosses', barcodes):
+        if row[0] not in index['crosses']:
+            index['crosses'][row[0]] = row[1]
+    for row in fetch_chunked('limages', barcodes):
+        index['images'].setdefault(row[0], []).append((row[1], row[2]))
+    logger.info("Found %d annotated lines, %d crosses, and %d images for %d cross barcodes",
+                len([val for val in index['assays'].values() if val]), len(index['crosses']),
+                sum([len(val) for val in index['images'].values()]), len(barcodes))
+    return index
+
+
+def process_cross(cross_id, line_id, line, newline, index):
     # Look for assays
-    try:
-        CURSOR['sage'].execute(READ['lassays'], (line,))
-    except MySQLdb.Error as err:
-        sql_error(err)
-    row = CURSOR['sage'].fetchone()
-    if row:
-        assays = row[1] if row[1] else 0
+    assays = index['assays'].get(line)
     if assays:
         logger.critical("Can't modify %s, is annotated: %s)" % (line, assays))
         COUNT['error'] += 1
         return
     # Find crosses
-    try:
-        CURSOR['sage'].execute(READ['crosses'], (cross_id, ))
-    except MySQLdb.Error as err:
-        sql_error(err)
-    row = CURSOR['sage'].fetchone()
-    if row:
-        logger.info("%s cross found for ID %s", row[0], cross_id)
+    if cross_id in index['crosses']:
+        logger.info("%s cross found for ID %s", index['crosses'][cross_id], cross_id)
     else:
         logger.warning("There are no crosses associated with cross ID %s (%s)", cross_id, line)
         COUNT['error'] += 1
         return
     # Search for images
-    try:
-        CURSOR['sage'].execute(READ['limages'], (cross_id, ))
-    except MySQLdb.Error as err:
-        sql_error(err)
-    rows = CURSOR['sage'].fetchall()
+    rows = index['images'].get(cross_id)
     if not rows:
         logger.warning("There are no images associated with cross ID %s (%s)", cross_id, line)
         COUNT['error'] += 1
         return
-    dlines = dict()
     for row in rows:
         if row[0] != line:
             logger.error("Cross ID %s was TMOGged for line %s, but should be associated with %s", cross_id, row[0], line)
             COUNT['error'] += 1
             return
-        logger.info("Found image %s for cross ID %s, line %s", row[1], cross_id, line)
-        print("<<Add code here to change lines associated with the above image ID>>")
+    for row in rows:
+        logger.debug("Found image %s for cross ID %s, line %s", row[1], cross_id, line)
+    logger.info("Will relink %d images for cross ID %s from %s to %s", len(rows), cross_id, line, newline)
+    RELINK.setdefault(newline, []).extend([row[1] for row in rows])
+
+
+def relink_images():
+    """ Move images to their new lines """
+    for newline, image_ids in RELINK.items():
+        try:
+            CURSOR['sage'].execute(READ['main'], (newline,))
+        except MySQLdb.Error as err:
+            FC.sql_error(err)
+        row = CURSOR['sage'].fetchone()
+        if not row:
+            logger.error("Can't relink %d images, new line %s is not in SAGE", len(image_ids), newline)
+            COUNT['error'] += 1
+            continue
+        for chunk in chunks(image_ids, ARG.CHUNK):
+            sql = WRITE['relinkimages'] % ('%s', ','.join(['%s'] * len(chunk)))
+            try:
+                CURSOR['sage'].execute(sql, [row[0]] + chunk)
+            except MySQLdb.Error as err:
+                FC.sql_error(err)
+            COUNT['relinked'] += CURSOR['sage'].rowcount
+        logger.info("Relinked %d images to %s", len(image_ids), newline)
 
 
 def process_file(filename):
@@ -224,6 +238,7 @@ def process_file(filename):
     except Exception as e:
         logger.critical('Failed to open input: '+ str(e))
         sys.exit(-1)
+    crosses = []
     for filerow in filehandle:
         filerow = filerow.rstrip()
         newline = ''
@@ -247,7 +262,7 @@ def process_file(filename):
         try:
             CURSOR['sage'].execute(READ['main'], (line,))
         except MySQLdb.Error as err:
-            sql_error(err)
+            FC.sql_error(err)
         rows = CURSOR['sage'].fetchall()
         if len(rows) == 0:
             logger.warning("Line %s is not in SAGE" % line)
@@ -257,9 +272,13 @@ def process_file(filename):
             COUNT['error'] += 1
         else:
             line_id = rows[0][0]
-            process_cross(cross_id, line_id, line, newline)
+            crosses.append((cross_id, line_id, line, newline))
     if filehandle is not sys.stdin:
         filehandle.close()
+    index = preload(crosses)
+    for cross in crosses:
+        process_cross(*cross, index)
+    relink_images()
     if ARG.WRITE:
         CONN['sage'].commit()
 
@@ -268,6 +287,8 @@ if __name__ == '__main__':
     PARSER = argparse.ArgumentParser(description="Check lines/cross barcodes for associated imagery and behavioral data")
     PARSER.add_argument('--file', dest='FILE', action='store',
                         default='', help='File containing lines or cross barcodes')
+    PARSER.add_argument('--chunk', dest='CHUNK', action='store', type=int,
+                        default=1000, help='Number of cross barcodes/images per query [1000]')
     PARSER.add_argument('--write', dest='WRITE', action='store_true',
                         default=False, help='Actually write changes to database')
     PARSER.add_argument('--verbose', dest='VERBOSE', action='store_true',
@@ -293,5 +314,6 @@ if __name__ == '__main__':
     print("Lines read: %d" % COUNT['read'])
     print("Lines deleted: %d" % COUNT['deleted'])
     print("Lines renamed: %d" % COUNT['renamed'])
+    print("Images relinked: %d" % COUNT['relinked'])
     print("Errors: %d" % COUNT['error'])
     sys.exit(0)
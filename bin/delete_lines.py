@@ -1,10 +1,11 @@
 import argparse
+import hashlib
 import json
 import select
 import sys
 import colorlog
-import requests
 import MySQLdb
+import flycore_common as FC
 
 # Database
 READ = {'main': "SELECT id FROM line WHERE name=%s",
@@ -21,64 +22,18 @@ WRITE = {'publishing': "DELETE FROM publishing_name WHERE line_id=%s",
         }
 CONN = dict()
 CURSOR = dict()
+JOURNAL = dict()
 
 # Configuration
 CONFIG = {'config': {'url': 'http://config.int.janelia.org/'}}
-COUNT = {"deleted": 0, "error": 0, "read": 0, "renamed": 0}
-
-
-def sql_error(err):
-    """ Log a critical SQL error and exit """
-    try:
-        logger.critical('MySQL error [%d]: %s', err.args[0], err.args[1])
-    except IndexError:
-        logger.critical('MySQL error: %s', err)
-    sys.exit(-1)
-
-
-def db_connect(db):
-    """ Connect to a database
-        Keyword arguments:
-        db: database dictionary
-    """
-    logger.debug("Connecting to %s on %s", db['name'], db['host'])
-    try:
-        conn = MySQLdb.connect(host=db['host'], user=db['user'],
-                               passwd=db['password'], db=db['name'])
-    except MySQLdb.Error as err:
-        sql_error(err)
-    try:
-        cursor = conn.cursor()
-        return(conn, cursor)
-    except MySQLdb.Error as err:
-        sql_error(err)
-
-
-def call_responder(server, endpoint):
-    """ Call a responder
-        Keyword arguments:
-        server: server
-        endpoint: REST endpoint
-    """
-    url = CONFIG[server]['url'] + endpoint
-    try:
-        req = requests.get(url)
-    except requests.exceptions.RequestException as err:
-        logger.critical(err)
-        sys.exit(-1)
-    if req.status_code != 200:
-        logger.error('Status: %s', str(req.status_code))
-        sys.exit(-1)
-    return req.json()
+COUNT = {"deleted": 0, "error": 0, "read": 0, "renamed": 0, "resumed": 0}
 
 
 def initialize_program():
     """ Initialize databases """
     global CONFIG
-    dbc = call_responder('config', 'config/db_config')
-    data = dbc['config']
-    (CONN['sage'], CURSOR['sage']) = db_connect(data['sage']['prod'])
-    dbc = call_responder('config', 'config/rest_services')
+    (CONN['sage'], CURSOR['sage']) = FC.connect_database(CONFIG, 'sage', 'prod')
+    dbc = FC.get_config(CONFIG, 'config/rest_services')
     CONFIG = dbc['config']
 
 
@@ -90,7 +45,7 @@ def delete_publishing(line_id):
         if (rowcount):
             logger.debug("Deleted publishing names (%d) for line ID %s" % (rowcount, line_id))
     except MySQLdb.Error as err:
-        sql_error(err)
+        FC.sql_error(err)
 
 
 def delete_relationship(line_id):
@@ -101,7 +56,7 @@ def delete_relationship(line_id):
         if (rowcount):
             logger.debug("Deleted line relationships (%d) for line ID %s" % (rowcount, line_id))
     except MySQLdb.Error as err:
-        sql_error(err)
+        FC.sql_error(err)
 
 
 def delete_event(line_id):
@@ -112,7 +67,7 @@ def delete_event(line_id):
         if (rowcount):
             logger.debug("Deleted line events (%d) for line ID %s" % (rowcount, line_id))
     except MySQLdb.Error as err:
-        sql_error(err)
+        FC.sql_error(err)
 
 
 def delete_lineprop(line_id):
@@ -123,7 +78,7 @@ def delete_lineprop(line_id):
         if (rowcount):
             logger.debug("Deleted line properties (%d) for line ID %s" % (rowcount, line_id))
     except MySQLdb.Error as err:
-        sql_error(err)
+        FC.sql_error(err)
 
 
 def delete_line(line_id):
@@ -137,7 +92,7 @@ def delete_line(line_id):
         if (rowcount):
             logger.debug("Deleted %d line for line ID %s" % (rowcount, line_id))
     except MySQLdb.Error as err:
-        sql_error(err)
+        FC.sql_error(err)
 
 
 def rename_line(line_id, newline):
@@ -145,7 +100,7 @@ def rename_line(line_id, newline):
     try:
         CURSOR['sage'].execute(READ['main'], (newline,))
     except MySQLdb.Error as err:
-        sql_error(err)
+        FC.sql_error(err)
     row = CURSOR['sage'].fetchone()
     if row:
         logger.debug("New line %s is already in SAGE (%s)", newline, row[0])
@@ -157,7 +112,7 @@ def rename_line(line_id, newline):
             if (rowcount):
                 logger.debug("Changed %d images from line ID %s to %s" % (rowcount, old_line_id, line_id))
         except MySQLdb.Error as err:
-            sql_error(err)
+            FC.sql_error(err)
         delete_line(old_line_id)
     else:
         logger.debug(WRITE['rename'] % (newline, line_id))
@@ -167,14 +122,14 @@ def rename_line(line_id, newline):
             if (rowcount):
                 logger.debug("Changed %d line name to %s for line ID %s" % (rowcount, newline, line_id))
         except MySQLdb.Error as err:
-            sql_error(err)
+            FC.sql_error(err)
 
 
 def process_line(line_id, line, newline):
     try:
         CURSOR['sage'].execute(READ['limages'], (line,))
     except MySQLdb.Error as err:
-        sql_error(err)
+        FC.sql_error(err)
     row = CURSOR['sage'].fetchone()
     images = 0
     if row:
@@ -183,7 +138,7 @@ def process_line(line_id, line, newline):
     try:
         CURSOR['sage'].execute(READ['lassays'], (line,))
     except MySQLdb.Error as err:
-        sql_error(err)
+        FC.sql_error(err)
     row = CURSOR['sage'].fetchone()
     assays = 0
     if row:
@@ -192,17 +147,18 @@ def process_line(line_id, line, newline):
     if assays:
         logger.critical("Can't modify %s, is annotated: %s)" % (line, assays))
         COUNT['error'] += 1
-        return
+        return False
     delete_publishing(line_id)
     if images:
         if not newline:
             logger.critical("Can't rename %s (%d images), new name is unknown" % (line, images))
             COUNT['error'] += 1
-        else:
-            logger.debug("Will rename %s to %s" % (line, newline))
-            rename_line(line_id, newline)
-            logger.info("Renamed %s to %s" % (line, newline))
-            COUNT['renamed'] += 1
+            # Not journaled: a resumed run retries the line
+            return False
+        logger.debug("Will rename %s to %s" % (line, newline))
+        rename_line(line_id, newline)
+        logger.info("Renamed %s to %s" % (line, newline))
+        COUNT['renamed'] += 1
     else:
         if not newline:
             logger.debug("Will delete %s" % line)
@@ -214,6 +170,74 @@ def process_line(line_id, line, newline):
             rename_line(line_id, newline)
             logger.info("Renamed %s to %s" % (line, newline))
             COUNT['renamed'] += 1
+    return True
+
+
+def start_journal(input_id):
+    """ Start a new journal for this input
+        Keyword arguments:
+        input_id: input file name and content hash
+    """
+    JOURNAL.clear()
+    if not ARG.WRITE:
+        return
+    try:
+        with open(ARG.JOURNAL, "w") as jhandle:
+            jhandle.write("# %s\n" % input_id)
+    except Exception as e:
+        logger.critical('Failed to write journal: '+ str(e))
+        sys.exit(-1)
+
+
+def read_journal(input_id):
+    """ Read lines that were committed by a previous run on the same input
+        Keyword arguments:
+        input_id: input file name and content hash
+    """
+    if not ARG.RESUME:
+        start_journal(input_id)
+        return
+    try:
+        with open(ARG.JOURNAL, "r") as jhandle:
+            header = jhandle.readline().rstrip()
+            if header != "# %s" % input_id:
+                logger.warning("Journal %s is for different input (%s) - starting from the beginning",
+                               ARG.JOURNAL, header[2:])
+                start_journal(input_id)
+                return
+            for jrow in jhandle:
+                JOURNAL[jrow.rstrip()] = True
+    except FileNotFoundError:
+        logger.warning("Journal %s does not exist - starting from the beginning", ARG.JOURNAL)
+        start_journal(input_id)
+        return
+    except Exception as e:
+        logger.critical('Failed to read journal: '+ str(e))
+        sys.exit(-1)
+    logger.info("Read %d committed lines from %s" % (len(JOURNAL), ARG.JOURNAL))
+
+
+def commit_chunk(handled):
+    """ Commit pending changes and journal the lines they changed
+        Keyword arguments:
+        handled: list of lines changed since the last commit
+    """
+    if not ARG.WRITE:
+        return
+    try:
+        CONN['sage'].commit()
+    except MySQLdb.Error as err:
+        FC.sql_error(err)
+    if handled:
+        try:
+            with open(ARG.JOURNAL, "a") as jhandle:
+                for line in handled:
+                    jhandle.write("%s\n" % line)
+        except Exception as e:
+            logger.critical('Failed to write journal: '+ str(e))
+            sys.exit(-1)
+        logger.debug("Committed %d lines" % len(handled))
+    del handled[:]
 
 
 def process_file(filename):
@@ -225,7 +249,13 @@ def process_file(filename):
     except Exception as e:
         logger.critical('Failed to open input: '+ str(e))
         sys.exit(-1)
-    for filerow in filehandle:
+    filerows = filehandle.readlines()
+    if filehandle is not sys.stdin:
+        filehandle.close()
+    digest = hashlib.sha256("".join(filerows).encode('utf-8')).hexdigest()
+    read_journal("%s %s" % (filename or 'STDIN', digest))
+    handled = []
+    for filerow in filerows:
         filerow = filerow.rstrip()
         newline = ''
         COUNT['read'] += 1
@@ -237,11 +267,15 @@ def process_file(filename):
                 logger.critical("Line name and new line name match: %s", line)
                 COUNT['error'] += 1
                 continue
+        if line in JOURNAL:
+            logger.debug("Skipping %s (already handled)" % line)
+            COUNT['resumed'] += 1
+            continue
         logger.debug("Read %s" % line)
         try:
             CURSOR['sage'].execute(READ['main'], (line,))
         except MySQLdb.Error as err:
-            sql_error(err)
+            FC.sql_error(err)
         rows = CURSOR['sage'].fetchall()
         if len(rows) == 0:
             logger.warning("Line %s is not in SAGE" % line)
@@ -251,17 +285,23 @@ def process_file(filename):
             COUNT['error'] += 1
         else:
             line_id = rows[0][0]
-            process_line(line_id, line, newline)
-    if filehandle is not sys.stdin:
-        filehandle.close()
-    if ARG.WRITE:
-        CONN['sage'].commit()
+            if process_line(line_id, line, newline):
+                handled.append(line)
+                if len(handled) >= ARG.CHUNK:
+                    commit_chunk(handled)
+    commit_chunk(handled)
 
 
 if __name__ == '__main__':
     PARSER = argparse.ArgumentParser(description="Check lines/cross barcodes for associated imagery and behavioral data")
     PARSER.add_argument('--file', dest='FILE', action='store',
                         default='', help='File containing lines or cross barcodes')
+    PARSER.add_argument('--chunk', dest='CHUNK', action='store', type=int,
+                        default=500, help='Number of lines to process per commit [500]')
+    PARSER.add_argument('--journal', dest='JOURNAL', action='store',
+                        default='delete_lines.journal', help='Journal of committed lines (restarted unless --resume)')
+    PARSER.add_argument('--resume', dest='RESUME', action='store_true',
+                        default=False, help='Skip lines already committed for the same input')
     PARSER.add_argument('--write', dest='WRITE', action='store_true',
                         default=False, help='Actually write changes to database')
     PARSER.add_argument('--verbose', dest='VERBOSE', action='store_true',
@@ -285,6 +325,7 @@ if __name__ == '__main__':
     initialize_program()
     process_file(ARG.FILE)
     print("Lines read: %d" % COUNT['read'])
+    print("Lines already handled: %d" % COUNT['resumed'])
     print("Lines deleted: %d" % COUNT['deleted'])
     print("Lines renamed: %d" % COUNT['renamed'])
     print("Errors: %d" % COUNT['error'])
@@ -2,6 +2,8 @@
 '''
 
 import argparse
+from datetime import date, datetime, timedelta
+import json
 from operator import attrgetter
 import sys
 import MySQLdb
@@ -9,72 +11,49 @@ from jrc_common import jrc_common
 
 # Database
 DB = {}
-READ = {"STOCKS": "SELECT stock_id,genotype,"
-                  + "SUBSTRING_INDEX(rack_location, '.', 2) AS copy_tray_a,"
-                  + "SUBSTRING_INDEX(rack_location_b, '.', 2) AS copy_tray_b, "
-                  + "CASE WHEN cell >0 AND cell <=24 THEN 'A' "
-                  + "WHEN cell >24 AND cell <=48 THEN 'B' "
-                  + "WHEN cell >48 AND cell <=72 THEN 'C' "
-                  + "WHEN cell >72 AND cell <=96 THEN 'D' ELSE NULL END AS relative_rack_a,"
-                  + "CASE WHEN cell_b >0 AND cell_b <=24 THEN 'A' "
-                  + "WHEN cell_b >24 AND cell_b <=48 THEN 'B' "
-                  + "WHEN cell_b >48 AND cell_b <=72 THEN 'C' "
-                  + "WHEN cell_b >72 AND cell_b <=96 THEN 'D' ELSE NULL END AS relative_rack_b,"
-                  + "last_flipped,last_flipped_b,rack AS rack_id_a,rack_b AS rack_id_b "
-                  + "FROM __flipper_flystocks_stock WHERE (IFNULL(rack_location,'')<>'' AND "
-                  + "rack_location LIKE 'A.%%') OR (IFNULL(rack_location_b,'')<>'' AND "
-                  + "rack_location_b like 'B.%%')",
-        "COUNT": "SELECT SUBSTRING_INDEX(rack_location, '.', 2) AS copy_tray,"
-                 + "CASE WHEN cell >0 AND cell <=24 THEN 'A' "
-                 + "WHEN cell >24 AND cell <=48 THEN 'B' "
-                 + "WHEN cell >48 AND cell <=72 THEN 'C' "
-                 + "WHEN cell >72 AND cell <=96 THEN 'D' ELSE 'ERROR' END AS relative_rack,"
-                 + "MAX(last_flipped) AS most_recent_last_flipped,rack AS rack_id,"
-                 + "COUNT(rack) AS count_rack FROM __flipper_flystocks_stock "
-                 + "WHERE IFNULL(rack_location,'')<>'' AND rack_location LIKE 'A.%%' "
-                 + "AND last_flipped >= DATE_ADD(DATE(NOW()), INTERVAL -10 DAY) "
-                 + "GROUP BY copy_tray,relative_rack,rack "
-                 + "ORDER BY copy_tray,relative_rack,rack_id,count_rack",
-        "COUNTB": "SELECT SUBSTRING_INDEX(rack_location_b, '.', 2) AS copy_tray,"
-                  + "CASE WHEN cell_b >0 AND cell_b <=24 THEN 'A' "
-                  + "WHEN cell_b >24 AND cell_b <=48 THEN 'B' "
-                  + "WHEN cell_b >48 AND cell_b <=72 THEN 'C' "
-                  + "WHEN cell_b >72 AND cell_b <=96 THEN 'D' ELSE 'ERROR' END AS relative_rack,"
-                  + "MAX(last_flipped_b) AS most_recent_last_flipped,rack_b AS rack_id,"
-                  + "COUNT(rack_b) AS count_rack FROM __flipper_flystocks_stock "
-                  + "WHERE IFNULL(rack_location_b,'')<>'' AND rack_location_b LIKE 'B.%%' "
-                  + "AND last_flipped_b >= DATE_ADD(DATE(NOW()), INTERVAL -10 DAY) "
-                  + "GROUP BY copy_tray,relative_rack,rack_b "
-                  + "ORDER BY copy_tray,relative_rack,rack_id,count_rack",
-        "IGNORE": "SELECT SUBSTRING_INDEX(rack_location, '.', 2) AS copy_tray,"
-                  + "MAX(last_flipped) AS most_recent_last_flipped,"
-                  + "MIN(last_flipped) AS oldest_last_flipped,"
-                  + "DATE_ADD(DATE(NOW()),INTERVAL -6 MONTH),DATE(NOW()),"
-                  + "CASE WHEN (MAX(last_flipped) < DATE_ADD(DATE(NOW()),INTERVAL -6 MONTH)) THEN "
-                  + "'No flips to tray in last 6 months' "
-                  + "WHEN (MAX(last_flipped)=DATE(NOW())) THEN 'Tray was flipped today' "
-                  + "ELSE 'CASE ERROR in IGNORE!' END AS ignore_reason "
+# copy_tray[_b] and relative_rack[_b] are generated columns
+# (see sql/flipper_stock_tray_columns.sql)
+READ = {"SCAN": "SELECT stock_id,genotype,copy_tray,copy_tray_b,relative_rack,relative_rack_b,"
+                + "last_flipped,last_flipped_b,rack,rack_b FROM __flipper_flystocks_stock "
+                + "WHERE copy_tray LIKE 'A.%%' OR copy_tray_b LIKE 'B.%%'",
+        "SCAN_TRAYS": "SELECT stock_id,genotype,copy_tray,copy_tray_b,relative_rack,"
+                      + "relative_rack_b,last_flipped,last_flipped_b,rack,rack_b "
+                      + "FROM __flipper_flystocks_stock "
+                      + "WHERE copy_tray IN ({trays}) OR copy_tray_b IN ({trays})",
+        "RECENT": "SELECT copy_tray,MAX(last_flipped) AS most_recent_last_flipped,"
+                  + "MIN(last_flipped) AS oldest_last_flipped,COUNT(1) AS flips "
                   + "FROM __flipper_flystocks_stock "
-                  +  "WHERE IFNULL(rack_location,'')<>'' AND rack_location LIKE 'A.%%' AND "
-                  + "IFNULL(last_flipped,'')<>'' GROUP BY copy_tray HAVING "
-                  + "(MAX(last_flipped) < DATE_ADD(DATE(NOW()),INTERVAL -6 MONTH)) OR "
-                  + "(MAX(last_flipped)=DATE(NOW())) "
-                  + "UNION SELECT SUBSTRING_INDEX(rack_location_b, '.', 2) as copy_tray,"
+                  + "WHERE last_flipped >= DATE_ADD(DATE(NOW()), INTERVAL -%s DAY) "
+                  + "AND copy_tray LIKE 'A.%%' GROUP BY copy_tray "
+                  + "UNION SELECT copy_tray_b AS copy_tray,"
                   + "MAX(last_flipped_b) AS most_recent_last_flipped,"
-                  + "MIN(last_flipped_b) AS oldest_last_flipped,"
-                  + "DATE_ADD(DATE(NOW()),INTERVAL -6 MONTH),DATE(NOW()),"
-                  + "CASE WHEN (MAX(last_flipped_b) < DATE_ADD(DATE(NOW()),INTERVAL -6 MONTH)) "
-                  + "THEN 'No flips to tray in last 6 months' "
-                  + "WHEN (MAX(last_flipped_b)=DATE(NOW())) THEN 'Tray was flipped today' "
-                  + "ELSE 'CASE ERROR in IGNORE!' END AS ignore_reason "
+                  + "MIN(last_flipped_b) AS oldest_last_flipped,COUNT(1) AS flips "
                   + "FROM __flipper_flystocks_stock "
-                  + "WHERE IFNULL(rack_location_b,'')<>'' AND rack_location_b LIKE 'B.%%' AND "
-                  + "IFNULL(last_flipped_b,'')<>'' GROUP BY copy_tray HAVING "
-                  + "(MAX(last_flipped_b) < DATE_ADD(DATE(NOW()),INTERVAL -6 MONTH)) OR "
-                  + "(MAX(last_flipped_b)=DATE(NOW()))",
+                  + "WHERE last_flipped_b >= DATE_ADD(DATE(NOW()), INTERVAL -%s DAY) "
+                  + "AND copy_tray_b LIKE 'B.%%' GROUP BY copy_tray_b",
        }
+# Rack corrections are loaded into a temporary table, then applied with one
+# UPDATE per column
+WRITE = {"TMP": "CREATE TEMPORARY TABLE IF NOT EXISTS rack_update "
+                + "(stock_id INT NOT NULL PRIMARY KEY,rack VARCHAR(255))",
+         "TMPCLEAR": "DELETE FROM rack_update",
+         "TMPINSERT": "INSERT INTO rack_update (stock_id,rack) VALUES %s",
+         "TMPROW": "(%s,%s)",
+         "rack": "UPDATE __flipper_flystocks_stock s JOIN rack_update t USING (stock_id) "
+                 + "SET s.rack=t.rack",
+         "rack_b": "UPDATE __flipper_flystocks_stock s JOIN rack_update t USING (stock_id) "
+                   + "SET s.rack_b=t.rack",
+        }
+# Number of rack corrections per INSERT into the temporary table
+UPDATE_CHUNK = 1000
+# Rack counts only consider stocks flipped within this many days
+RECENT_DAYS = 10
+# Trays with no flips within this many months are ignored
+INACTIVE_MONTHS = 6
 # Counter
 COUNT = {"updates": 0}
+# Pending rack corrections: (stock_id, rack) tuples keyed by column
+UPDATES = {"rack": [], "rack_b": []}
 
 
 def terminate_program(msg=None):
@@ -108,118 +87,219 @@ def initialize_program():
         terminate_program(jrc_common.sql_error(err))
 
 
-def group_list_items_by_common_attribute(alist, getterfunc):
-    """ Return a dict with key as key, holding a list of all of the elements
+def as_date(value):
+    """ Return a date for a date, datetime, or empty value
         Keyword arguments:
-          alist: input dictionary
-          getterfunc: lambda function for input dict values
+          value: column value
         Returns:
-          Grouped dictionary
-    Return a dict with key as key, holding a list of all of the elements
-    example:
-    list1=[{'a':1},{'a':2},{'a':3},{'a':1}]
-    def gfunc1(val):
-        return str(val.get('a',''))
-    print group_list_items_by_common_key(list1,gfunc1)
-    >> {'1': [{'a': 1}, {'a': 1}], '3': [{'a': 3}], '2': [{'a': 2}]}
+          date or None
     """
-    retdict={}
-    for item in alist:
-        currentkey=getterfunc(item)
-        #if not retdict.has_key(currentkey):
-        if currentkey not in retdict:
-            retdict[currentkey]=[item]
-        else:
-            retdict[currentkey].append(item)
-    assert len(alist)==sum([len(subitems) for subitems in retdict.values()])
-    return retdict
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def months_ago(today, months):
+    """ Return a date a number of months in the past (as MySQL's DATE_ADD)
+        Keyword arguments:
+          today: starting date
+          months: number of months
+        Returns:
+          date
+    """
+    month = today.month - 1 - months
+    year = today.year + month // 12
+    month = month % 12 + 1
+    day = today.day
+    while True:
+        try:
+            return date(year, month, day)
+        except ValueError:
+            day -= 1
 
 
-def get_tray_rack_counts():
-    """ Get counts for A and B racks
+def reduce_rack_counts(counts):
+    """ Reduce rack counts to one majority record per tray quadrant
+        Keyword arguments:
+          counts: rack count records keyed by (copy tray, quadrant, rack)
+        Returns:
+          Dictionary of majority records keyed by (copy tray, quadrant)
+    """
+    grouped = {}
+    for rec in counts.values():
+        grouped.setdefault((rec['copy_tray'], rec['relative_rack']), []).append(rec)
+    d_rack_info = {}
+    for key, choices in grouped.items():
+        # The rack to use is the one with the highest number of cells
+        choices.sort(key=lambda r: (r['count_rack'], r['rack_id'] is not None,
+                                    r['rack_id'] or ''))
+        winner = choices[-1]
+        if winner['rack_id'] is None or not winner['count_rack']:
+            # Never replace real racks with NULL
+            LOGGER.warning("Skipping tray %s quadrant %s: no recently flipped stock "
+                           "has a rack", *key)
+            continue
+        runner_up = choices[-2]['count_rack'] if len(choices) > 1 else 0
+        d_rack_info[key] = {'rack_id': winner['rack_id'],
+                            'count_rack': winner['count_rack'],
+                            'runner_up': runner_up,
+                            'ambiguous': len(choices) > 1 and winner['count_rack'] <= runner_up,
+                            'choices': choices}
+    return d_rack_info
+
+
+def get_recent_trays():
+    """ Get trays flipped within the rack count window, with a signature of the
+        flips inside the window. The signature changes when a tray is flipped and
+        when a flip ages out of the window, which can change the majority rack.
         Keyword arguments:
           None
         Returns:
-          Dictionary
+          Dictionary of [most recent flip, oldest flip, flips] keyed by copy tray
     """
     try:
-        DB["flyboy"]["cursor"].execute(READ['COUNT'])
-        rows = DB["flyboy"]["cursor"].fetchall()
-    except MySQLdb.Error as err:
-        terminate_program(jrc_common.sql_error(err))
-    LOGGER.info("Rack A count: %d", len(rows))
-    d_a_copy = group_list_items_by_common_attribute(rows, lambda row: (row['copy_tray'],
-                                                                       row['relative_rack']))
-    try:
-        DB["flyboy"]["cursor"].execute(READ['COUNTB'])
+        DB["flyboy"]["cursor"].execute(READ['RECENT'], (RECENT_DAYS, RECENT_DAYS))
         rows = DB["flyboy"]["cursor"].fetchall()
     except MySQLdb.Error as err:
         terminate_program(jrc_common.sql_error(err))
-    LOGGER.info("Rack B count: %d", len(rows))
-    d_b_copy = group_list_items_by_common_attribute(rows, lambda row: (row['copy_tray'],
-                                                                       row['relative_rack']))
-    d_a_copy.update(d_b_copy)
-    # Sample key/value:
-    # ('B.RB031', 'C'): [{'copy_tray': 'B.RB031', 'relative_rack': 'C',
-    #                     'most_recent_last_flipped': datetime.date(2023, 5, 8),
-    #                     'rack_id': '1176', 'count_rack': 8}]
-    return d_a_copy
+    LOGGER.info("Recently flipped trays: %d", len(rows))
+    return {row['copy_tray']: [str(as_date(row['most_recent_last_flipped'])),
+                               str(as_date(row['oldest_last_flipped'])), int(row['flips'])]
+            for row in rows}
 
 
-def get_stock_records():
-    """ Get stocks
+def read_checkpoint():
+    """ Read trays that have already been reconciled
         Keyword arguments:
           None
         Returns:
-          Dictionary
+          Dictionary of flip signatures keyed by copy tray
     """
     try:
-        DB["flyboy"]["cursor"].execute(READ['STOCKS'])
-        rows = DB["flyboy"]["cursor"].fetchall()
-    except MySQLdb.Error as err:
-        terminate_program(jrc_common.sql_error(err))
-    LOGGER.info("Stocks: %d", len(rows))
-    # Sample key/value:
-    # {'stock_id': 9999992, 'genotype': 'TEST#3', 'copy_tray_a': 'A.GR59',
-    #  'copy_tray_b': None, 'relative_rack_a': 'D', 'relative_rack_b': None,
-    #  'last_flipped': datetime.date(2013, 1, 29), 'last_flipped_b': None,
-    #  'rack_id_a': '0975', 'rack_id_b': None}
-    return rows
+        with open(ARG.CHECKPOINT, 'r', encoding='ascii') as infile:
+            return json.load(infile)
+    except FileNotFoundError:
+        LOGGER.warning("Checkpoint %s does not exist - all recent trays will be processed",
+                       ARG.CHECKPOINT)
+    except Exception as err:
+        terminate_program(f"Could not read checkpoint {ARG.CHECKPOINT}: {err}")
+    return {}
 
 
-def get_trays_to_ignore():
-    """ Get trays that can be ignored (based on 6 months of inactivity)
+def write_checkpoint(checkpoint):
+    """ Write trays that have been reconciled
         Keyword arguments:
+          checkpoint: dictionary of flip signatures keyed by copy tray
+        Returns:
           None
+    """
+    oldest = str(date.today() - timedelta(days=RECENT_DAYS))
+    checkpoint = {tray: flips for tray, flips in checkpoint.items()
+                  if isinstance(flips, list) and flips[0] >= oldest}
+    try:
+        with open(ARG.CHECKPOINT, 'w', encoding='ascii') as outfile:
+            json.dump(checkpoint, outfile, indent=2, sort_keys=True)
+    except Exception as err:
+        terminate_program(f"Could not write checkpoint {ARG.CHECKPOINT}: {err}")
+    LOGGER.info("Wrote %d trays to %s", len(checkpoint), ARG.CHECKPOINT)
+
+
+def scan_stock_table(trays=None):
+    """ Read the stock table once, and compute stocks, rack counts, and trays to ignore
+        Keyword arguments:
+          trays: optional list of copy trays to restrict the scan to
         Returns:
-          Dictionary
+          List of stocks, rack count dictionary, ignore dictionary
     """
+    today = date.today()
+    recent = today - timedelta(days=RECENT_DAYS)
+    inactive = months_ago(today, INACTIVE_MONTHS)
+    stocks = []
+    counts = {}
+    last_flip = {}
     try:
-        DB["flyboy"]["cursor"].execute(READ['IGNORE'])
-        rows = DB["flyboy"]["cursor"].fetchall()
+        cursor = DB["flyboy"]["conn"].cursor(MySQLdb.cursors.SSDictCursor)
+        if trays is None:
+            cursor.execute(READ['SCAN'])
+        else:
+            sql = READ['SCAN_TRAYS'].format(trays=','.join(['%s'] * len(trays)))
+            cursor.execute(sql, list(trays) * 2)
+        for row in cursor:
+            stock = {'stock_id': row['stock_id'], 'genotype': row['genotype']}
+            for copy, sfx in (('A', ''), ('B', '_b')):
+                tray = row['copy_tray' + sfx]
+                rack = row['relative_rack' + sfx]
+                flipped = as_date(row['last_flipped' + sfx])
+                stock['copy_tray_' + copy.lower()] = tray
+                stock['relative_rack_' + copy.lower()] = rack
+                stock['rack_id_' + copy.lower()] = row['rack' + sfx]
+                stock['last_flipped' + sfx] = row['last_flipped' + sfx]
+                if not (tray and tray[:2].upper() == copy + '.'):
+                    continue
+                if trays is not None and tray not in trays:
+                    continue
+                if flipped:
+                    last_flip[tray] = max(flipped, last_flip.get(tray, flipped))
+                if flipped and flipped >= recent:
+                    key = (tray, rack or 'ERROR', row['rack' + sfx])
+                    if key not in counts:
+                        counts[key] = {'copy_tray': tray, 'relative_rack': rack or 'ERROR',
+                                       'most_recent_last_flipped': flipped,
+                                       'rack_id': row['rack' + sfx], 'count_rack': 0}
+                    rec = counts[key]
+                    rec['most_recent_last_flipped'] = max(flipped,
+                                                          rec['most_recent_last_flipped'])
+                    if row['rack' + sfx] is not None:
+                        rec['count_rack'] += 1
+            stocks.append(stock)
+        cursor.close()
     except MySQLdb.Error as err:
         terminate_program(jrc_common.sql_error(err))
-    LOGGER.info("Trays to ignore: %d", len(rows))
+    LOGGER.info("Stocks: %d", len(stocks))
+    # Sample stock:
+    # {'stock_id': 9999992, 'genotype': 'TEST#3', 'copy_tray_a': 'A.GR59',
+    #  'copy_tray_b': None, 'relative_rack_a': 'D', 'relative_rack_b': None,
+    #  'last_flipped': datetime.date(2013, 1, 29), 'last_flipped_b': None,
+    #  'rack_id_a': '0975', 'rack_id_b': None}
+    LOGGER.info("Rack count: %d", len(counts))
+    d_rack_info = reduce_rack_counts(counts)
+    # Sample key/value:
+    # ('B.RB031', 'C'): {'rack_id': '1176', 'count_rack': 8, 'runner_up': 3,
+    #                    'ambiguous': False, 'choices': [...]}
+    d_ignore = {}
+    for tray, flipped in last_flip.items():
+        if flipped < inactive:
+            d_ignore[tray] = f"No flips to tray in last {INACTIVE_MONTHS} months"
+        elif flipped == today:
+            d_ignore[tray] = 'Tray was flipped today'
+    LOGGER.info("Trays to ignore: %d", len(d_ignore))
     # Sample key/value:
     # 'B.UH1': 'No flips to tray in last 6 months'
-    return dict([(row['copy_tray'], row['ignore_reason']) for row in rows])
+    return stocks, d_rack_info, d_ignore
 
 
 def format_rack_info_record(rack_info):
     """ Format a rack record
         Keyword arguments:
-          rack_info: dictionary
+          rack_info: majority record
         Returns:
           Reformatted rack
     """
-    return "\n".join([str(r) for r in rack_info])
+    return "\n".join([str(r) for r in rack_info['choices']])
 
 
 def update_stock(stock, rack_info, copy):
     """ Update a single stock
         Keyword arguments:
           stock: stock record
-          rack_info: rack record
+          rack_info: majority record for the stock's quadrant
           copy: "A" or "B"
         Returns:
           None
@@ -232,35 +312,48 @@ def update_stock(stock, rack_info, copy):
         rack_id_sql = 'rack_b'
     else:
         raise ValueError(f"invalid copy {copy}")
-     # Figure out if and how to fix the rack of this stock
-    if rack_info:
-        if len(rack_info) >= 1:
-            # The rack to use is the one with the highest number of cells so sort
-            # by the count and take the one at the end.
-            rack_info.sort(key=lambda r: r['count_rack'])
-            correct_rack_rec = rack_info[-1]
-            # Make sure we have a majority if multiple
-            if len(rack_info)==1 or \
-               (correct_rack_rec['count_rack'] > rack_info[-2]['count_rack']):
-                if stock[rack_id_var] != correct_rack_rec['rack_id']:
-                    sql = f"UPDATE __flipper_flystocks_stock SET {rack_id_sql}=" \
-                          + f"{correct_rack_rec['rack_id']} WHERE stock_id={stock['stock_id']}"
-                    LOGGER.debug(sql)
-                    DB["flyboy"]["cursor"].execute(sql)
-                    COUNT["updates"] += 1
-                    LOGGER.info(f"Changed stock id {stock['stock_id']}'s column {rack_id_sql} " \
-                                + f"from {stock[rack_id_var]} to {correct_rack_rec['rack_id']}. " \
-                                + f"Rack Choices were:{format_rack_info_record(rack_info)}")
-            else:
-                LOGGER.warning(f"Not updating stock {stock['stock_id']}/" \
-                               + f"rack {stock[rack_id_var]} " \
-                               + "because there is no clear majority in the " \
-                               + f"quadrant:{format_rack_info_record(rack_info)}")
-        else:
-            raise ValueError(f"Invalid rack info for key {key}")
-    else:
+    if not rack_info:
         # This normally means the tray wasn't flipped recently
         LOGGER.debug("Could not find rack info for copy %s stock: %s", copy, stock)
+        return
+    # Make sure we have a majority if multiple
+    if rack_info['ambiguous']:
+        LOGGER.warning(f"Not updating stock {stock['stock_id']}/" \
+                       + f"rack {stock[rack_id_var]} " \
+                       + "because there is no clear majority in the " \
+                       + f"quadrant:{format_rack_info_record(rack_info)}")
+    elif stock[rack_id_var] != rack_info['rack_id']:
+        LOGGER.debug("Set %s=%s for stock %s", rack_id_sql, rack_info['rack_id'],
+                     stock['stock_id'])
+        UPDATES[rack_id_sql].append((stock['stock_id'], rack_info['rack_id']))
+        COUNT["updates"] += 1
+        LOGGER.info(f"Changed stock id {stock['stock_id']}'s column {rack_id_sql} " \
+                    + f"from {stock[rack_id_var]} to {rack_info['rack_id']}. " \
+                    + f"Rack Choices were:{format_rack_info_record(rack_info)}")
+
+
+def apply_updates():
+    """ Apply pending rack corrections in batches
+        Keyword arguments:
+          None
+        Returns:
+          None
+    """
+    cursor = DB["flyboy"]["cursor"]
+    for column, updates in UPDATES.items():
+        if not updates:
+            continue
+        try:
+            cursor.execute(WRITE['TMP'])
+            cursor.execute(WRITE['TMPCLEAR'])
+            for idx in range(0, len(updates), UPDATE_CHUNK):
+                chunk = updates[idx:idx + UPDATE_CHUNK]
+                cursor.execute(WRITE['TMPINSERT'] % ','.join([WRITE['TMPROW']] * len(chunk)),
+                               [val for row in chunk for val in row])
+            cursor.execute(WRITE[column])
+        except MySQLdb.Error as err:
+            terminate_program(jrc_common.sql_error(err))
+        LOGGER.debug("Updated %d %s values", cursor.rowcount, column)
 
 
 def fix_ids():
@@ -270,9 +363,18 @@ def fix_ids():
         Returns:
           None
     """
-    stocks = get_stock_records()
-    d_rack_info = get_tray_rack_counts()
-    d_ignore = get_trays_to_ignore()
+    if ARG.INCREMENTAL:
+        checkpoint = read_checkpoint()
+        recent = get_recent_trays()
+        trays = {tray: flips for tray, flips in recent.items()
+                 if checkpoint.get(tray) != flips}
+        LOGGER.info("Trays to reconcile: %d", len(trays))
+        if not trays:
+            print("No recently flipped trays have changed since the last run")
+            return
+        stocks, d_rack_info, d_ignore = scan_stock_table(trays)
+    else:
+        stocks, d_rack_info, d_ignore = scan_stock_table()
     ignore_msg = "Ignoring stock %s because its tray %s should be ignored because: %s"
     for stock in stocks:
         if stock['copy_tray_a'] and stock['relative_rack_a']:
@@ -292,11 +394,17 @@ def fix_ids():
         if not ((stock['copy_tray_a'] and stock['relative_rack_a']) or \
                 (stock['copy_tray_b'] and stock['relative_rack_b'])):
             LOGGER.debug("Ignoring stock %s because it is missing a tray or rack", stock)
+    apply_updates()
     print("All stocks have been processed")
     print(f"Updated {COUNT['updates']} rows")
     if ARG.WRITE:
         DB["flyboy"]["conn"].commit()
         print("Committed DB Changes")
+        if ARG.INCREMENTAL:
+            # Trays flipped today will be reconciled on a later run
+            checkpoint.update({tray: flips for tray, flips in trays.items()
+                               if tray not in d_ignore})
+            write_checkpoint(checkpoint)
 
 # -----------------------------------------------------------------------------
 
@@ -306,6 +414,11 @@ if __name__ == '__main__':
         description='Fix flyflipper racks')
     PARSER.add_argument('--manifold', dest='MANIFOLD', action='store',
                         default='prod', choices=['prod', 'dev'], help='Manifold [prod]')
+    PARSER.add_argument('--incremental', action='store_true', dest='INCREMENTAL',
+                        default=False, help='Only process trays whose recent flips changed since the last run')
+    PARSER.add_argument('--checkpoint', dest='CHECKPOINT', action='store',
+                        default='fix_robot_rack_id.checkpoint.json',
+                        help='Checkpoint file for --incremental')
     PARSER.add_argument('--write', action='store_true', dest='WRITE',
                         default=False, help='Send email')
     PARSER.add_argument('--verbose', action='store_true', dest='VERBOSE',
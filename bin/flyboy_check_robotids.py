@@ -3,79 +3,36 @@ Remove duplicate Robot IDs from FlyBoy
 """
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import sys
 import colorlog
-import requests
 import MySQLdb
+import flycore_common as FC
 
 # Database
-READ = {'DUPLICATES': "SELECT RobotID,COUNT(1) AS c FROM StockFinder WHERE " +
-                      "RobotID IS NOT NULL AND RobotID>0 GROUP BY 1 HAVING c>1",
-        'ROBOT': "SELECT RobotID,__kp_UniqueID,Stock_Name FROM StockFinder WHERE RobotID=%s",
+READ = {'DUPLICATES': "SELECT sf.RobotID,sf.__kp_UniqueID,sf.Stock_Name FROM StockFinder sf " +
+                      "JOIN (SELECT RobotID FROM StockFinder WHERE RobotID IS NOT NULL AND " +
+                      "RobotID>0 GROUP BY 1 HAVING COUNT(1)>1) dup ON " +
+                      "(dup.RobotID=sf.RobotID) ORDER BY 1",
        }
-WRITE = {'DELETE': "DELETE FROM StockFinder WHERE __kp_UniqueID=%s",
+WRITE = {'DELETE': "DELETE FROM StockFinder WHERE __kp_UniqueID IN (%s)",
         }
 CONN = dict()
 CURSOR = dict()
 # Configuration
 CONFIG = {'config': {'url': 'http://config.int.janelia.org/'}}
+# Number of KP IDs per DELETE
+CHUNK = 500
 # General
 COUNT = {'robot': 0, 'kp': 0, 'delete': 0}
 
 
-def sql_error(err):
-    """ Log a critical SQL error and exit """
-    try:
-        LOGGER.critical('MySQL error [%d]: %s', err.args[0], err.args[1])
-    except IndexError:
-        LOGGER.critical('MySQL error: %s', err)
-    sys.exit(-1)
-
-
-def db_connect(dbc):
-    """ Connect to specified database
-        Keyword arguments:
-        db: database key
-    """
-    LOGGER.info("Connecting to %s on %s", dbc['name'], dbc['host'])
-    try:
-        conn = MySQLdb.connect(host=dbc['host'], user=dbc['user'],
-                               passwd=dbc['password'], db=dbc['name'])
-    except MySQLdb.Error as err:
-        sql_error(err)
-    try:
-        cursor = conn.cursor()
-        return(conn, cursor)
-    except MySQLdb.Error as err:
-        sql_error(err)
-
-
-def call_responder(server, endpoint):
-    """ Call a responder
-        Keyword arguments:
-        server: server
-        endpoint: REST endpoint
-    """
-    url = CONFIG[server]['url'] + endpoint
-    try:
-        req = requests.get(url)
-    except requests.exceptions.RequestException as err:
-        LOGGER.critical(err)
-        sys.exit(-1)
-    if req.status_code != 200:
-        LOGGER.error('Status: %s', str(req.status_code))
-        sys.exit(-1)
-    return req.json()
-
-
 def initialize_program():
     """ Connect to FlyBoy database
     """
     global CONFIG
-    dbc = call_responder('config', 'config/db_config')
-    data = dbc['config']
-    (CONN['flyboy'], CURSOR['flyboy']) = db_connect(data['flyboy'][ARG.MANIFOLD])
-    dbc = call_responder('config', 'config/rest_services')
+    (CONN['flyboy'], CURSOR['flyboy']) = FC.connect_database(CONFIG, 'flyboy', ARG.MANIFOLD)
+    dbc = FC.get_config(CONFIG, 'config/rest_services')
     CONFIG = dbc['config']
 
 
@@ -83,46 +40,69 @@ def update_flyboy():
     """ Remove duplicate Robot IDs from StockFinder
     """
     LOGGER.info('Fetching duplicate Robot IDs from FlyBoy')
+    FC.phase('prefetch')
     try:
         CURSOR['flyboy'].execute(READ['DUPLICATES'])
         rows = CURSOR['flyboy'].fetchall()
     except MySQLdb.Error as err:
-        sql_error(err)
+        FC.sql_error(err)
+    robots = dict()
     for row in rows:
+        robots.setdefault(row[0], []).append(row)
+    fbrows = []
+    for robotid, robotrows in robots.items():
         COUNT['robot'] += 1
-        LOGGER.debug(READ['ROBOT'], row[0])
-        try:
-            CURSOR['flyboy'].execute(READ['ROBOT'], (str(row[0]),))
-            fbrows = CURSOR['flyboy'].fetchall()
-        except MySQLdb.Error as err:
-            sql_error(err)
-        for fbrow in fbrows:
-            kpid = str(int(fbrow[1]))
+        LOGGER.debug('Robot ID %s has %d StockFinder records', robotid, len(robotrows))
+        fbrows.extend(robotrows)
+    kpids = [str(int(fbrow[1])) for fbrow in fbrows]
+    FC.phase('fetch')
+    with ThreadPoolExecutor(max_workers=ARG.THREADS) as executor:
+        futures = [executor.submit(FC.fetch_responder, CONFIG, 'flycore',
+                                   '?request=linedata&kp=' + kpid) for kpid in kpids]
+        delete = []
+        for fbrow, kpid, future in zip(fbrows, kpids, futures):
+            try:
+                resp = future.result()
+            except FC.ResponderError as err:
+                # Don't send the queued requests
+                executor.shutdown(wait=False, cancel_futures=True)
+                LOGGER.critical(err)
+                sys.exit(-1)
             LOGGER.debug('Robot ID %s (KP %s, stock name %s)', fbrow[0], kpid, fbrow[2])
-            resp = call_responder('flycore', '?request=linedata&kp=' + kpid)
             COUNT['kp'] += 1
             if 'linedata' in resp and resp['linedata'] == '':
                 LOGGER.warning('KP %s (Robot ID %s) is not in FLYF2', kpid, fbrow[0])
-                LOGGER.debug(WRITE['DELETE'], row[0])
-                try:
-                    CURSOR['flyboy'].execute(WRITE['DELETE'], (kpid,))
-                    if CURSOR['flyboy'].rowcount:
-                        COUNT['delete'] += 1
-                    else:
-                        LOGGER.error("Could not delete KPID %s from StockFinder", kpid)
-                except MySQLdb.Error as err:
-                    sql_error(err)
+                delete.append(kpid)
+    FC.phase('process')
+    for idx in range(0, len(delete), CHUNK):
+        chunk = delete[idx:idx + CHUNK]
+        sql = FC.format_statement(WRITE['DELETE'], ','.join(['%s'] * len(chunk)))
+        LOGGER.debug(sql, *chunk)
+        try:
+            CURSOR['flyboy'].execute(sql, chunk)
+        except MySQLdb.Error as err:
+            FC.sql_error(err)
+        COUNT['delete'] += CURSOR['flyboy'].rowcount
+        if CURSOR['flyboy'].rowcount != len(chunk):
+            LOGGER.error("Could only delete %d of %d KPIDs from StockFinder",
+                         CURSOR['flyboy'].rowcount, len(chunk))
     if ARG.WRITE:
+        FC.phase('commit')
         CONN['flyboy'].commit()
+    FC.phase()
 
 
 if __name__ == '__main__':
     PARSER = argparse.ArgumentParser(description="Remove duplicate Robot IDs from FlyBoy")
     PARSER.add_argument('--manifold', dest='MANIFOLD', action='store',
                         default='prod', help='Database manifold')
+    PARSER.add_argument('--threads', dest='THREADS', action='store', type=int,
+                        default=8, help='Number of concurrent FLYF2 requests [8]')
     PARSER.add_argument('--write', dest='WRITE', action='store_true',
                         default=False,
                         help='Flag, Actually modify database')
+    PARSER.add_argument('--metrics', dest='METRICS', action='store',
+                        help='Write metrics to this file (.prom or JSON)')
     PARSER.add_argument('--verbose', dest='VERBOSE', action='store_true',
                         default=False, help='Flag, Chatty')
     PARSER.add_argument('--debug', dest='DEBUG', action='store_true',
@@ -141,6 +121,11 @@ if __name__ == '__main__':
     HANDLER.setFormatter(colorlog.ColoredFormatter())
     LOGGER.addHandler(HANDLER)
 
+    FC.set_pool_size(ARG.THREADS)
+    FC.register_statements(READ=READ, WRITE=WRITE)
+    if ARG.METRICS:
+        FC.export_metrics(ARG.METRICS, 'flyboy_check_robotids', COUNT)
+    FC.phase('config')
     initialize_program()
     update_flyboy()
     print("Duplicate Robot IDs in StockFinder: %d" % COUNT['robot'])
@@ -0,0 +1,632 @@
+''' flycore_common.py
+    Database and REST helpers shared by the FlyCore utility programs.
+'''
+import atexit
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+import MySQLdb
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+LOGGER = logging.getLogger(__name__)
+# HTTP: (connect, read) timeout in seconds, retries for idempotent requests
+TIMEOUT = (10, 120)
+RETRY = Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504],
+              allowed_methods=['GET'])
+# MySQL: connection attempts and delay (seconds) between them. A statement that
+# fails because the server went away (2006) or the connection was lost (2013)
+# is retried once on a new connection, unless that would lose uncommitted writes.
+DB_RETRIES = 3
+DB_RETRY_DELAY = 2
+DB_RECONNECT_ERRORS = (2006, 2013)
+# Access denied: cached credentials may be out of date
+DB_AUTH_ERRORS = (1044, 1045)
+DB_READS = ('SELECT', 'SHOW', 'DESCRIBE', 'EXPLAIN')
+# Config service: local cache of bootstrap data (db_config, rest_services).
+# Entries younger than CONFIG_TTL seconds are used as-is; older entries are
+# served immediately and refreshed in the background, up to CONFIG_MAX_AGE.
+# FLYCORE_CONFIG_URL points the programs at another config service (such as
+# the benchmark stub). Cache entries are keyed by config service URL, so
+# responses from one service are never served for another.
+CONFIG_URL = os.environ.get('FLYCORE_CONFIG_URL')
+CONFIG_CACHE = os.environ.get('FLYCORE_CONFIG_CACHE',
+                              os.path.join(os.path.expanduser('~'), '.cache', 'flycore'))
+CONFIG_TTL = 15 * 60
+CONFIG_MAX_AGE = 7 * 24 * 3600
+# Temporary files older than this (seconds) were left by an interrupted write
+CONFIG_TMP_AGE = 600
+CONFIG_STATE = {'cleaned': False}
+# Metrics: wall time per phase, SQL statements per READ/WRITE key, HTTP calls per host
+METRICS = {'phases': {}, 'sql': {}, 'http': {}}
+METRICS_LOCK = threading.Lock()
+PHASE = {'name': None, 'start': None}
+STATEMENTS = {}
+
+
+def phase(name=None):
+    """ End the current phase and start another one
+        Keyword arguments:
+          name: phase name (config, fetch, prefetch, process, commit), None to just end
+        Returns:
+          None
+    """
+    now = time.perf_counter()
+    if PHASE['name']:
+        METRICS['phases'][PHASE['name']] = METRICS['phases'].get(PHASE['name'], 0) \
+                                          + now - PHASE['start']
+    PHASE['name'], PHASE['start'] = name, now
+
+
+def register_statements(**groups):
+    """ Register statement dictionaries so SQL metrics are keyed by name
+        Keyword arguments:
+          groups: statement dictionaries, e.g. READ=READ, WRITE=WRITE
+        Returns:
+          None
+    """
+    for group, statements in groups.items():
+        for key, sql in statements.items():
+            STATEMENTS[sql] = f"{group}.{key}"
+
+
+def format_statement(sql, *fill):
+    """ Fill in a registered statement (such as an IN list of placeholders) and
+        register the result under the same key
+        Keyword arguments:
+          sql: registered statement
+          fill: values for the statement's format specifiers
+        Returns:
+          Formatted statement
+    """
+    formatted = sql % fill
+    if sql in STATEMENTS:
+        STATEMENTS[formatted] = STATEMENTS[sql]
+    return formatted
+
+
+def statement_type(sql):
+    """ Return the type (first word) of a SQL statement
+        Keyword arguments:
+          sql: SQL statement
+        Returns:
+          Statement type
+    """
+    return sql.split(None, 1)[0].upper() if sql.strip() else 'other'
+
+
+def statement_key(sql):
+    """ Return the registered key for a SQL statement
+        Keyword arguments:
+          sql: SQL statement
+        Returns:
+          Key (the statement type if the statement is not registered)
+    """
+    return STATEMENTS.get(sql) or statement_type(sql)
+
+
+def record(kind, key, seconds, size=0):
+    """ Record a SQL statement or HTTP call
+        Keyword arguments:
+          kind: sql or http
+          key: statement key or host
+          seconds: elapsed time
+          size: response bytes (HTTP)
+        Returns:
+          None
+    """
+    with METRICS_LOCK:
+        entry = METRICS[kind].setdefault(key, {'count': 0, 'seconds': 0, 'bytes': 0})
+        entry['count'] += 1
+        entry['seconds'] += seconds
+        entry['bytes'] += size
+
+
+class InstrumentedSession(requests.Session):
+    """ Session that records the latency (including retries and reading the
+        body) and the bytes received over the wire for every request
+    """
+
+    def request(self, method, url, *args, **kwargs):  # pylint: disable=arguments-differ
+        start = time.perf_counter()
+        size = 0
+        try:
+            response = super().request(method, url, *args, **kwargs)
+            size = response_size(response)
+            return response
+        finally:
+            record('http', urlsplit(url).netloc, time.perf_counter() - start, size)
+
+
+def response_size(response):
+    """ Return the size of a response body as received (before decompression)
+        Keyword arguments:
+          response: requests response
+        Returns:
+          Size in bytes
+    """
+    try:
+        size = response.raw.tell()
+        if size:
+            return size
+    except (AttributeError, OSError):
+        pass
+    try:
+        return int(response.headers.get('Content-Length', 0))
+    except ValueError:
+        return 0
+
+
+SESSION = InstrumentedSession()
+SESSION.headers.update({'Accept-Encoding': 'gzip, deflate'})
+
+
+def set_pool_size(size):
+    """ Mount HTTP adapters with a connection pool large enough for concurrent requests
+        Keyword arguments:
+          size: maximum number of pooled connections per host
+        Returns:
+          None
+    """
+    for prefix in ('http://', 'https://'):
+        SESSION.mount(prefix, HTTPAdapter(pool_connections=size, pool_maxsize=size,
+                                          max_retries=RETRY))
+
+
+set_pool_size(10)
+
+
+class InstrumentedCursor:
+    """ Cursor wrapper that records statement counts and latency, and retries
+        statements once after a lost connection
+    """
+
+    def __init__(self, cursor, conn=None, args=()):
+        self._cursor = cursor
+        self._conn = conn
+        self._args = args
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def _timed(self, method, sql, args):
+        for attempt in (1, 2):
+            start = time.perf_counter()
+            try:
+                result = getattr(self._cursor, method)(sql, args)
+                if self._conn and (method == 'callproc'
+                                   or statement_type(sql) not in DB_READS):
+                    self._conn.pending = True
+                return result
+            except MySQLdb.OperationalError as err:
+                if attempt > 1 or not self._conn or not self._conn.can_reconnect(err):
+                    raise
+                LOGGER.warning("Lost connection to %s (%s), reconnecting",
+                               self._conn.dbc['host'], err.args[-1])
+                self._conn.reconnect()
+                self._cursor = self._conn.raw_cursor(*self._args)
+            finally:
+                record('sql', statement_key(sql), time.perf_counter() - start)
+        return None
+
+    def execute(self, sql, args=None):
+        """ Execute a statement """
+        return self._timed('execute', sql, args)
+
+    def executemany(self, sql, args):
+        """ Execute a statement for a sequence of parameters """
+        return self._timed('executemany', sql, args)
+
+    def callproc(self, procname, args=()):
+        """ Call a stored procedure """
+        return self._timed('callproc', procname, args)
+
+
+class Connection:
+    """ Connection wrapper that tracks uncommitted writes so cursors can
+        reconnect safely
+    """
+
+    def __init__(self, dbc, autocommit=False, retries=DB_RETRIES):
+        self.dbc = dbc
+        self.autocommit = autocommit
+        self.retries = retries
+        self.pending = False
+        self._conn = _connect(dbc, autocommit, retries)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def can_reconnect(self, err):
+        """ Return True if a statement that failed with err can be retried on a
+            new connection
+        """
+        if err.args[0] not in DB_RECONNECT_ERRORS:
+            return False
+        if self.pending and not self.autocommit:
+            LOGGER.error("Lost connection to %s with uncommitted writes", self.dbc['host'])
+            return False
+        return True
+
+    def reconnect(self):
+        """ Replace the connection """
+        try:
+            self._conn.close()
+        except MySQLdb.Error:
+            pass
+        self._conn = _connect(self.dbc, self.autocommit, self.retries)
+        self.pending = False
+
+    def raw_cursor(self, *args):
+        """ Return an uninstrumented cursor """
+        return self._conn.cursor(*args)
+
+    def cursor(self, *args):
+        """ Return an instrumented cursor """
+        return InstrumentedCursor(self._conn.cursor(*args), self, args)
+
+    def commit(self):
+        """ Commit the transaction """
+        self._conn.commit()
+        self.pending = False
+
+    def rollback(self):
+        """ Roll back the transaction """
+        self._conn.rollback()
+        self.pending = False
+
+
+def export_metrics(filename, job, counts=None):
+    """ Write metrics when the program exits (including early and error exits)
+        Keyword arguments:
+          filename: output file (.prom for a Prometheus textfile, otherwise JSON)
+          job: job name
+          counts: COUNT dictionary to export alongside the timings
+        Returns:
+          None
+    """
+    atexit.register(write_metrics, filename, job, counts)
+
+
+def prometheus_label(value):
+    """ Escape a Prometheus label value """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(metrics):
+    """ Format metrics in the Prometheus text exposition format
+        Keyword arguments:
+          metrics: metrics dictionary from write_metrics
+        Returns:
+          Text
+    """
+    job = prometheus_label(metrics['job'])
+    samples = {'flycore_last_run_timestamp_seconds': [(f'job="{job}"', metrics['timestamp'])]}
+    for name, seconds in metrics['phases'].items():
+        samples.setdefault('flycore_phase_seconds', []).append(
+            (f'job="{job}",phase="{prometheus_label(name)}"', seconds))
+    # Every value covers one run, so all metrics are gauges
+    for kind, label, unit in (('sql', 'key', 'statements'), ('http', 'host', 'requests')):
+        for key, entry in metrics[kind].items():
+            labels = f'job="{job}",{label}="{prometheus_label(key)}"'
+            samples.setdefault(f"flycore_{kind}_{unit}", []).append((labels, entry['count']))
+            samples.setdefault(f"flycore_{kind}_seconds", []).append(
+                (labels, entry['seconds']))
+            if kind == 'http':
+                samples.setdefault('flycore_http_bytes', []).append(
+                    (labels, entry['bytes']))
+    for name, value in metrics['counts'].items():
+        samples.setdefault('flycore_count', []).append(
+            (f'job="{job}",name="{prometheus_label(name)}"', value))
+    lines = []
+    for metric, values in samples.items():
+        lines.append(f"# TYPE {metric} gauge")
+        lines.extend(f"{metric}{{{labels}}} {value}" for labels, value in values)
+    return '\n'.join(lines) + '\n'
+
+
+def write_metrics(filename, job, counts=None):
+    """ Write metrics as a Prometheus textfile (.prom) or JSON (anything else)
+        Keyword arguments:
+          filename: output file
+          job: job name
+          counts: COUNT dictionary to export alongside the timings
+        Returns:
+          None
+    """
+    phase()
+    with METRICS_LOCK:
+        metrics = json.loads(json.dumps(METRICS))
+    metrics['job'] = job
+    metrics['counts'] = counts or {}
+    metrics['timestamp'] = time.time()
+    if filename.endswith('.prom'):
+        content = prometheus_text(metrics)
+    else:
+        content = json.dumps(metrics, indent=2)
+    # Write atomically so a textfile collector never reads a partial file
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as outstream:
+        outstream.write(content)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, filename)
+
+
+def sql_error(err):
+    """ Log a critical SQL error and exit
+        Keyword arguments:
+          err: MySQLdb error
+        Returns:
+          None
+    """
+    try:
+        LOGGER.critical('MySQL error [%d]: %s', err.args[0], err.args[1])
+    except IndexError:
+        LOGGER.critical('MySQL error: %s', err)
+    sys.exit(-1)
+
+
+def _connect(dbc, autocommit=False, retries=DB_RETRIES):
+    """ Open a MySQL connection, retrying on operational errors
+        Keyword arguments:
+          dbc: database configuration dictionary
+          autocommit: commit after every statement
+          retries: number of connection attempts
+        Returns:
+          MySQLdb connection
+    """
+    for attempt in range(1, retries + 1):
+        try:
+            return MySQLdb.connect(host=dbc['host'], port=int(dbc.get('port', 3306)),
+                                   user=dbc['user'], passwd=dbc['password'],
+                                   db=dbc['name'], autocommit=autocommit)
+        except MySQLdb.OperationalError as err:
+            if attempt >= retries or err.args[0] in DB_AUTH_ERRORS:
+                raise
+            LOGGER.warning("Could not connect to %s (attempt %d of %d)", dbc['host'],
+                           attempt, retries)
+            time.sleep(DB_RETRY_DELAY * attempt)
+    return None
+
+
+def db_connect(dbc, autocommit=False, retries=DB_RETRIES, reload=None):
+    """ Connect to specified database
+        Keyword arguments:
+          dbc: database configuration dictionary
+          autocommit: commit after every statement
+          retries: number of connection attempts
+          reload: optional function returning fresh configuration if access is denied
+        Returns:
+          connection, cursor
+    """
+    LOGGER.info("Connecting to %s on %s", dbc['name'], dbc['host'])
+    try:
+        conn = Connection(dbc, autocommit, retries)
+        cursor = conn.cursor()
+    except MySQLdb.OperationalError as err:
+        if not reload or err.args[0] not in DB_AUTH_ERRORS:
+            sql_error(err)
+        LOGGER.warning("Access denied to %s, reloading credentials", dbc['host'])
+        return db_connect(reload(), autocommit, retries)
+    except MySQLdb.Error as err:
+        sql_error(err)
+    return conn, cursor
+
+
+def connect_database(config, source, manifold, autocommit=False):
+    """ Connect to a database using credentials from the config service. If the
+        cached credentials are rejected, they are fetched again.
+        Keyword arguments:
+          config: REST configuration dictionary
+          source: database (sage, flyboy)
+          manifold: manifold (dev, prod)
+          autocommit: commit after every statement
+        Returns:
+          connection, cursor
+    """
+    def reload():
+        evict_config(config, 'config/db_config')
+        return get_config(config, 'config/db_config', refresh=True)['config'][source][manifold]
+
+    dbc = get_config(config, 'config/db_config')['config'][source][manifold]
+    return db_connect(dbc, autocommit, reload=reload)
+
+
+class ResponderError(Exception):
+    """ A responder call failed """
+
+
+def fetch_responder(config, server, endpoint, timeout=TIMEOUT):
+    """ Call a responder, raising ResponderError on failure (for worker threads,
+        where exiting would not stop the program)
+        Keyword arguments:
+          config: REST configuration dictionary
+          server: server
+          endpoint: REST endpoint
+          timeout: request timeout
+        Returns:
+          JSON response
+    """
+    url = config[server]['url'] + endpoint
+    try:
+        req = SESSION.get(url, timeout=timeout)
+    except requests.exceptions.RequestException as err:
+        raise ResponderError(err) from err
+    if req.status_code != 200:
+        raise ResponderError(f"Status: {req.status_code} ({url})")
+    return req.json()
+
+
+def call_responder(config, server, endpoint, timeout=TIMEOUT):
+    """ Call a responder, exiting on failure
+        Keyword arguments:
+          config: REST configuration dictionary
+          server: server
+          endpoint: REST endpoint
+          timeout: request timeout
+        Returns:
+          JSON response
+    """
+    try:
+        return fetch_responder(config, server, endpoint, timeout)
+    except ResponderError as err:
+        LOGGER.critical(err)
+        sys.exit(-1)
+
+
+def _config_url(config):
+    """ Return the config service base URL
+        Keyword arguments:
+          config: REST configuration dictionary
+        Returns:
+          URL
+    """
+    return CONFIG_URL or config['config']['url']
+
+
+def _config_cache_file(config, endpoint):
+    """ Return the cache file for a config service endpoint
+        Keyword arguments:
+          config: REST configuration dictionary
+          endpoint: REST endpoint
+        Returns:
+          File path
+    """
+    service = hashlib.sha256(_config_url(config).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(CONFIG_CACHE,
+                        f"{service}_{endpoint.strip('/').replace('/', '_')}.json")
+
+
+def _clean_config_cache():
+    """ Remove temporary files left by interrupted cache writes (such as a
+        background refresh that was still running when its program exited)
+        Keyword arguments:
+          None
+        Returns:
+          None
+    """
+    if CONFIG_STATE['cleaned']:
+        return
+    CONFIG_STATE['cleaned'] = True
+    try:
+        names = os.listdir(CONFIG_CACHE)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(CONFIG_CACHE, name)
+        try:
+            if name.endswith('.tmp') and time.time() - os.path.getmtime(path) > CONFIG_TMP_AGE:
+                os.remove(path)
+        except OSError as err:
+            LOGGER.warning("Could not remove %s: %s", path, err)
+
+
+def evict_config(config, endpoint):
+    """ Remove a config service response from the cache
+        Keyword arguments:
+          config: REST configuration dictionary
+          endpoint: REST endpoint
+        Returns:
+          None
+    """
+    try:
+        os.remove(_config_cache_file(config, endpoint))
+    except FileNotFoundError:
+        pass
+    except OSError as err:
+        LOGGER.warning("Could not evict cached %s: %s", endpoint, err)
+
+
+def _read_config_cache(config, endpoint):
+    """ Read a cached config service response
+        Keyword arguments:
+          config: REST configuration dictionary
+          endpoint: REST endpoint
+        Returns:
+          age in seconds, cached response (None, None if not cached)
+    """
+    path = _config_cache_file(config, endpoint)
+    try:
+        with open(path, 'r', encoding='utf-8') as cfile:
+            data = json.load(cfile)
+        return time.time() - os.path.getmtime(path), data
+    except (OSError, ValueError):
+        return None, None
+
+
+def _write_config_cache(config, endpoint, data):
+    """ Atomically write a config service response readable only by its owner
+        Keyword arguments:
+          config: REST configuration dictionary
+          endpoint: REST endpoint
+          data: response
+        Returns:
+          None
+    """
+    try:
+        os.makedirs(CONFIG_CACHE, mode=0o700, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=CONFIG_CACHE, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as cfile:
+            json.dump(data, cfile)
+        os.chmod(tmp, 0o600)
+        os.replace(tmp, _config_cache_file(config, endpoint))
+    except OSError as err:
+        LOGGER.warning("Could not cache %s: %s", endpoint, err)
+
+
+def _fetch_config(config, endpoint):
+    """ Fetch from the config service and cache the response
+        Keyword arguments:
+          config: REST configuration dictionary
+          endpoint: REST endpoint
+        Returns:
+          JSON response (None on failure)
+    """
+    try:
+        req = SESSION.get(_config_url(config) + endpoint, timeout=TIMEOUT)
+        req.raise_for_status()
+        data = req.json()
+    except (requests.exceptions.RequestException, ValueError) as err:
+        LOGGER.warning("Could not fetch %s: %s", endpoint, err)
+        return None
+    _write_config_cache(config, endpoint, data)
+    return data
+
+
+def get_config(config, endpoint, refresh=False):
+    """ Get bootstrap data from the config service, using a local cache
+        Keyword arguments:
+          config: REST configuration dictionary
+          endpoint: REST endpoint
+          refresh: bypass the cache
+        Returns:
+          JSON response
+    """
+    _clean_config_cache()
+    age, data = (None, None) if refresh else _read_config_cache(config, endpoint)
+    if age is not None and age < CONFIG_TTL:
+        return data
+    if age is not None and age < CONFIG_MAX_AGE:
+        LOGGER.debug("Revalidating cached %s (%ds old)", endpoint, age)
+        threading.Thread(target=_fetch_config, args=(config, endpoint),
+                         daemon=True).start()
+        return data
+    fresh = _fetch_config(config, endpoint)
+    if fresh is not None:
+        return fresh
+    if data is not None:
+        LOGGER.warning("Config service unavailable, using cached %s", endpoint)
+        return data
+    LOGGER.critical("Could not get %s from the config service", endpoint)
+    sys.exit(-1)
@@ -5,30 +5,103 @@
 import argparse
 import datetime
 from operator import attrgetter
+import sqlite3
 import sys
 import MySQLdb
-import pandas as pd
 import jrc_common.jrc_common as JRC
 
 # pylint: disable=logging-fstring-interpolation
 
 # Database
-READ = {"RID": "SELECT COUNT(1) AS c FROM FlyStore_line_order_history_vw WHERE RobotID=%s",
-        "STOCK": "SELECT loh.stock_name,sf.Project AS project,sf.Project_SubCat AS subcat"
+READ = {"STOCK": "SELECT loh.stock_name,sf.Project AS project,sf.Project_SubCat AS subcat"
                  + ",loh.RobotID,sf.Genotype_GSI_Name_PlateWell AS genotype,sf.Lab_ID AS labid"
                  + ",YEAR(date_filled) AS year,COUNT(1) AS cnt FROM "
                  + "FlyStore_line_order_history_vw loh LEFT OUTER JOIN StockFinder sf ON "
                  + "(sf.Stock_Name=loh.stock_name) WHERE "
                  + "loh.stock_name IS NOT NULL AND loh.stock_name != 'KEEP EMPTY' AND "
-                 + "date_filled IS NOT NULL GROUP BY 1,2,3,4,5,6,7",
+                 + "date_filled IS NOT NULL {range}GROUP BY 1,2,3,4,5,6,7",
         "ROBOT": "SELECT loh.stock_name,sf.Project AS project,sf.Project_SubCat AS subcat"
                  + ",loh.RobotID,sf.Genotype_GSI_Name_PlateWell AS genotype,sf.Lab_ID AS labid"
                  + ",YEAR(date_filled) AS year,COUNT(1) AS cnt FROM "
                  + "FlyStore_line_order_history_vw loh LEFT OUTER JOIN StockFinder sf ON "
                  + "(sf.RobotID=loh.RobotID) WHERE date_filled IS NOT NULL "
-                 + "GROUP BY 1,2,3,4,5,6,7",
+                 + "{range}{robotids}GROUP BY 1,2,3,4,5,6,7",
+        # Order report notebook: stocks in StockFinder, not split by RobotID
+        "MAIN": "SELECT loh.stock_name,sf.Project AS project,sf.Project_SubCat AS subcat"
+                + ",YEAR(date_filled) AS year,COUNT(1) AS cnt FROM "
+                + "FlyStore_line_order_history_vw loh JOIN StockFinder sf ON "
+                + "(sf.Stock_Name=loh.stock_name) WHERE "
+                + "loh.stock_name IS NOT NULL AND loh.stock_name != 'KEEP EMPTY' "
+                + "AND date_filled IS NOT NULL {range}GROUP BY 1,2,3,4",
+        # Order counts alone (StockFinder attributes are looked up separately)
+        "STOCKCOUNT": "SELECT stock_name,RobotID,YEAR(date_filled) AS year,COUNT(1) AS cnt "
+                      + "FROM FlyStore_line_order_history_vw WHERE stock_name IS NOT NULL "
+                      + "AND stock_name != 'KEEP EMPTY' AND date_filled IS NOT NULL "
+                      + "{range}GROUP BY 1,2,3",
+        "MAINCOUNT": "SELECT stock_name,YEAR(date_filled) AS year,COUNT(1) AS cnt "
+                     + "FROM FlyStore_line_order_history_vw WHERE stock_name IS NOT NULL "
+                     + "AND stock_name != 'KEEP EMPTY' AND date_filled IS NOT NULL "
+                     + "{range}GROUP BY 1,2",
+        "ROBOTCOUNT": "SELECT loh.stock_name,loh.RobotID,YEAR(date_filled) AS year,"
+                      + "COUNT(1) AS cnt FROM FlyStore_line_order_history_vw loh "
+                      + "WHERE date_filled IS NOT NULL {range}{robotids}GROUP BY 1,2,3",
+        "SFSTOCK": "SELECT Stock_Name AS stock_name,Project AS project,"
+                   + "Project_SubCat AS subcat,Genotype_GSI_Name_PlateWell AS genotype,"
+                   + "Lab_ID AS labid FROM StockFinder WHERE Stock_Name IS NOT NULL",
+        "SFROBOT": "SELECT RobotID,Project AS project,Project_SubCat AS subcat,"
+                   + "Genotype_GSI_Name_PlateWell AS genotype,Lab_ID AS labid "
+                   + "FROM StockFinder WHERE RobotID IN ({robotids})",
        }
+# Local cache of yearly order counts for settled years. Only the counts are
+# cached: StockFinder attributes can change, so they are always read from FlyBoy.
+# STOCK rows serve both the STOCK and MAIN reports.
+CACHE = {"VERSION": 3,
+         "DROP": ["DROP TABLE IF EXISTS orders", "DROP TABLE IF EXISTS watermark",
+                  "DROP TABLE IF EXISTS robot_watermark"],
+         "CREATE": ["CREATE TABLE IF NOT EXISTS orders (kind TEXT,stock_name TEXT,"
+                    + "RobotID INTEGER,year INTEGER,cnt INTEGER)",
+                    "CREATE INDEX IF NOT EXISTS orders_kind_robotid_ind ON orders "
+                    + "(kind,RobotID)",
+                    "CREATE TABLE IF NOT EXISTS watermark (kind TEXT PRIMARY KEY,"
+                    + "year INTEGER)",
+                    "CREATE TABLE IF NOT EXISTS robot_watermark (RobotID INTEGER PRIMARY KEY,"
+                    + "year INTEGER)"],
+         "WATERMARK": "SELECT year FROM watermark WHERE kind=?",
+         "SETWATERMARK": "REPLACE INTO watermark (kind,year) VALUES (?,?)",
+         "ROBOTWATERMARK": "SELECT RobotID,year FROM robot_watermark WHERE RobotID IN ({robotids})",
+         "SETROBOTWATERMARK": "REPLACE INTO robot_watermark (RobotID,year) VALUES (?,?)",
+         "DELETE": "DELETE FROM orders WHERE kind=?",
+         "DELETEROBOT": "DELETE FROM orders WHERE kind='ROBOT' AND RobotID IN ({robotids})",
+         "INSERT": "INSERT INTO orders (kind,stock_name,RobotID,year,cnt) VALUES (?,?,?,?,?)",
+         "STOCK": "SELECT stock_name,RobotID,year,cnt FROM orders WHERE kind='STOCK'",
+         "MAIN": "SELECT stock_name,year,SUM(cnt) AS cnt FROM orders WHERE kind='STOCK' "
+                 + "GROUP BY stock_name,year",
+         "ROBOT": "SELECT stock_name,RobotID,year,cnt FROM orders WHERE kind='ROBOT' "
+                  + "AND RobotID IN ({robotids})",
+        }
+# Columns returned by each kind of query
+COLUMNS = {"STOCK": ["stock_name", "project", "subcat", "RobotID", "genotype", "labid", "year",
+                     "cnt"],
+           "MAIN": ["stock_name", "project", "subcat", "year", "cnt"]}
+COLUMNS["ROBOT"] = COLUMNS["STOCK"]
+# StockFinder attributes added to cached and recent order counts
+STOCKFINDER = ["project", "subcat", "genotype", "labid"]
+ARG = LOGGER = None
 DB = {}
+# Report column names for attribute columns in the order history rows
+ATTRIBUTES = {"RobotID": "RobotID", "project": "Project", "subcat": "SubCat",
+              "genotype": "Genotype", "labid": "Lab ID"}
+# Number of robot IDs per query
+CHUNK = 1000
+# Number of robot IDs per SQLite query (older SQLite allows at most 999 variables)
+SQLITE_CHUNK = 900
+# Orders for the current and previous year are always read from FlyBoy, so late or
+# backfilled orders are picked up
+LIVE_YEARS = 2
+# Number of rows per fetch from the server-side cursor
+FETCH_CHUNK = 10000
+# Number of report rows per write
+WRITE_CHUNK = 50000
 
 # -----------------------------------------------------------------------------
 
@@ -63,51 +136,383 @@ def initialize_program():
         terminate_program(JRC.sql_error(err))
 
 
-def search_by_stock():
-    """ Search FlyBoy by stock name
+def fetch_chunks(sql, args=None):
+    """ Stream rows from a server-side cursor
         Keyword arguments:
-          None
+          sql: SQL statement
+          args: statement arguments
         Returns:
-          Empty dictionary, rows from select
+          Generator of lists of rows
     """
+    cursor = DB['flyboy']['conn'].cursor(MySQLdb.cursors.SSDictCursor)
     try:
-        DB['flyboy']['cursor'].execute(READ['STOCK'])
-        rows = DB['flyboy']['cursor'].fetchall()
+        cursor.execute(sql, args)
+        while True:
+            rows = cursor.fetchmany(FETCH_CHUNK)
+            if not rows:
+                break
+            yield rows
     except MySQLdb.Error as err:
         terminate_program(JRC.sql_error(err))
-    LOGGER.info(f"Found {len(rows):,} rows")
-    return {}, rows
+    finally:
+        cursor.close()
 
 
-def search_by_robotid():
-    """ Search FlyBoy by robot ID
+def dict_factory(cursor, row):
+    """ Return SQLite rows as dictionaries
+        Keyword arguments:
+          cursor: SQLite cursor
+          row: row tuple
+        Returns:
+          Dictionary
+    """
+    return {col[0]: row[idx] for idx, col in enumerate(cursor.description)}
+
+
+def sqlite_chunks(cursor):
+    """ Read rows from a SQLite cursor in chunks
+        Keyword arguments:
+          cursor: SQLite cursor
+        Returns:
+          Generator of lists of rows
+    """
+    while True:
+        rows = cursor.fetchmany(FETCH_CHUNK)
+        if not rows:
+            break
+        yield rows
+
+
+def settled_year():
+    """ Return the first year that is always read from FlyBoy
         Keyword arguments:
           None
         Returns:
-          Dictionary of robot IDs, rows from select
-    """
-    frobotids = {}
-    LOGGER.info(f"Reading Robot IDs from {ARG.FILE}")
-    with open(ARG.FILE, 'r', encoding='ascii') as infile:
-        robotids = dict((rid.rstrip(), True) for rid in infile)
-    LOGGER.info(f"Read {len(robotids):,} robot IDs from {ARG.FILE}")
-    for rid in robotids:
-        try:
-            DB['flyboy']['cursor'].execute(READ['RID'], (rid,))
-            cnt = DB['flyboy']['cursor'].fetchone()
-            if cnt['c']:
-                frobotids[str(rid)] = True
-        except MySQLdb.Error as err:
-            terminate_program(JRC.sql_error(err))
-    LOGGER.info(f"Filtered to {len(frobotids):,} Robot IDs")
+          Year
+    """
+    return datetime.datetime.now().year - LIVE_YEARS + 1
+
+
+def open_cache(cache):
+    """ Open the cache, rebuilding it if it was written by an older version
+        Keyword arguments:
+          cache: cache file
+        Returns:
+          SQLite connection
+    """
+    conn = sqlite3.connect(cache)
+    conn.row_factory = dict_factory
+    if conn.execute("PRAGMA user_version").fetchone()['user_version'] != CACHE['VERSION']:
+        for stmt in CACHE['DROP']:
+            conn.execute(stmt)
+        conn.execute(f"PRAGMA user_version={CACHE['VERSION']}")
+    for stmt in CACHE['CREATE']:
+        conn.execute(stmt)
+    return conn
+
+
+def cache_rows(conn, kind, rows):
+    """ Add order counts to the cache
+        Keyword arguments:
+          conn: SQLite connection
+          kind: "STOCK" or "ROBOT"
+          rows: rows from an order count query
+        Returns:
+          None
+    """
+    conn.executemany(CACHE['INSERT'], [(kind, row['stock_name'], row['RobotID'], row['year'],
+                                        row['cnt']) for row in rows])
+
+
+def year_range(start, end):
+    """ Return a date_filled range clause and arguments
+        Keyword arguments:
+          start: first year (None for no lower bound)
+          end: first year after the range
+        Returns:
+          Clause, arguments
+    """
+    if start:
+        return "AND date_filled >= %s AND date_filled < %s ", [f"{start}-01-01",
+                                                               f"{end}-01-01"]
+    return "AND date_filled < %s ", [f"{end}-01-01"]
+
+
+def update_cache(cache, refresh=False):
+    """ Make sure the cache holds order counts by stock for every settled year
+        Keyword arguments:
+          cache: cache file
+          refresh: rebuild the cache from scratch
+        Returns:
+          SQLite connection, first year that is not cached
+    """
+    settled = settled_year()
+    kind = 'STOCK'
+    try:
+        conn = open_cache(cache)
+        row = conn.execute(CACHE['WATERMARK'], (kind,)).fetchone()
+        start = row['year'] if row and not refresh else None
+        if start is None:
+            conn.execute(CACHE['DELETE'], (kind,))
+        if start is None or start < settled:
+            LOGGER.info(f"Caching {kind.lower()} orders for years "
+                        + (f"{start}-{settled - 1}" if start else f"before {settled}"))
+            rng, args = year_range(start, settled)
+            for rows in fetch_chunks(READ['STOCKCOUNT'].format(range=rng), args):
+                cache_rows(conn, kind, rows)
+            conn.execute(CACHE['SETWATERMARK'], (kind, settled))
+            conn.commit()
+    except sqlite3.Error as err:
+        terminate_program(f"Could not update cache {cache}: {err}")
+    return conn, settled
+
+
+def update_robot_cache(cache, robotids, refresh=False):
+    """ Make sure the cache holds order counts for every settled year for the
+        requested robot IDs. Only robot IDs that are not yet cached are read.
+        Keyword arguments:
+          cache: cache file
+          robotids: list of robot IDs
+          refresh: re-read the requested robot IDs
+        Returns:
+          SQLite connection, first year that is not cached
+    """
+    settled = settled_year()
+    try:
+        conn = open_cache(cache)
+        watermark = {}
+        for idx in range(0, len(robotids), SQLITE_CHUNK):
+            chunk = robotids[idx:idx + SQLITE_CHUNK]
+            placeholders = ','.join(['?'] * len(chunk))
+            if refresh:
+                conn.execute(CACHE['DELETEROBOT'].format(robotids=placeholders), chunk)
+                continue
+            for row in conn.execute(CACHE['ROBOTWATERMARK'].format(robotids=placeholders),
+                                    chunk):
+                watermark[row['RobotID']] = row['year']
+        # Robot IDs to read, grouped by the first year that is not cached
+        missing = {}
+        for rid in robotids:
+            start = watermark.get(rid)
+            if start is None or start < settled:
+                missing.setdefault(start, []).append(rid)
+        LOGGER.info(f"Caching orders for {sum(len(rids) for rids in missing.values()):,} "
+                    + "robot IDs")
+        for start, rids in missing.items():
+            rng, args = year_range(start, settled)
+            for idx in range(0, len(rids), CHUNK):
+                chunk = rids[idx:idx + CHUNK]
+                sql = READ['ROBOTCOUNT'].format(range=rng, robotids="AND loh.RobotID IN "
+                                                + f"({','.join(['%s'] * len(chunk))}) ")
+                for rows in fetch_chunks(sql, args + chunk):
+                    cache_rows(conn, 'ROBOT', rows)
+            conn.executemany(CACHE['SETROBOTWATERMARK'], [(rid, settled) for rid in rids])
+        conn.commit()
+    except sqlite3.Error as err:
+        terminate_program(f"Could not update cache {cache}: {err}")
+    return conn, settled
+
+
+def stockfinder_attributes(sql, key, args=None):
+    """ Read current StockFinder attributes
+        Keyword arguments:
+          sql: StockFinder query
+          key: column to key the attributes by
+          args: query arguments
+        Returns:
+          Dictionary of attribute dictionaries
+    """
+    attributes = {}
+    for rows in fetch_chunks(sql, args):
+        for row in rows:
+            attributes.setdefault(row[key], {col: row[col] for col in STOCKFINDER})
+    return attributes
+
+
+def add_attributes(rows, attributes, key, kind):
+    """ Add StockFinder attributes to order count rows
+        Keyword arguments:
+          rows: order count rows
+          attributes: StockFinder attributes from stockfinder_attributes
+          key: column the attributes are keyed by
+          kind: "STOCK", "MAIN" (only stocks in StockFinder), or "ROBOT"
+        Returns:
+          List of rows with the columns of the kind's order history query
+    """
+    full = []
+    for row in rows:
+        attrs = attributes.get(row[key])
+        if attrs is None and kind == 'MAIN':
+            continue
+        row = {**row, **(attrs or {})}
+        full.append({col: row.get(col) for col in COLUMNS[kind]})
+    return full
+
+
+def search_by_stock(cache=None, refresh=False, kind='STOCK'):
+    """ Search FlyBoy by stock name
+        Keyword arguments:
+          cache: optional cache file for settled years
+          refresh: rebuild the cache from scratch
+          kind: "STOCK" (all ordered stocks) or "MAIN" (stocks in StockFinder)
+        Returns:
+          Generator of lists of rows from select
+    """
+    if not cache:
+        yield from fetch_chunks(READ[kind].format(range=''))
+        return
+    conn, settled = update_cache(cache, refresh)
+    attributes = stockfinder_attributes(READ['SFSTOCK'], 'stock_name')
+    for rows in sqlite_chunks(conn.execute(CACHE[kind])):
+        yield add_attributes(rows, attributes, 'stock_name', kind)
+    conn.close()
+    for rows in fetch_chunks(READ[f"{kind}COUNT"].format(range="AND date_filled >= %s "),
+                             [f"{settled}-01-01"]):
+        yield add_attributes(rows, attributes, 'stock_name', kind)
+
+
+def search_by_robotid(filename, cache=None, refresh=False):
+    """ Search FlyBoy by robot ID
+        Keyword arguments:
+          filename: file of robot IDs
+          cache: optional cache file for settled years
+          refresh: re-read the requested robot IDs into the cache
+        Returns:
+          Generator of lists of rows from select
+    """
+    LOGGER.info(f"Reading Robot IDs from {filename}")
+    robotids = {}
+    with open(filename, 'r', encoding='ascii') as infile:
+        for rid in infile:
+            if not rid.strip():
+                continue
+            try:
+                robotids[int(rid)] = True
+            except ValueError:
+                LOGGER.warning(f"Ignoring invalid Robot ID {rid.strip()}")
+    robotids = list(robotids)
+    LOGGER.info(f"Read {len(robotids):,} robot IDs from {filename}")
+    if cache:
+        conn, settled = update_robot_cache(cache, robotids, refresh)
     LOGGER.info("Fetching orders")
+    found = set()
+    for idx in range(0, len(robotids), CHUNK):
+        chunk = robotids[idx:idx + CHUNK]
+        placeholders = ','.join(['%s'] * len(chunk))
+        if not cache:
+            sql = READ['ROBOT'].format(range='', robotids=f"AND loh.RobotID IN ({placeholders}) ")
+            for rows in fetch_chunks(sql, chunk):
+                found.update(row['RobotID'] for row in rows)
+                yield rows
+            continue
+        attributes = stockfinder_attributes(READ['SFROBOT'].format(robotids=placeholders),
+                                            'RobotID', chunk)
+        for sidx in range(0, len(chunk), SQLITE_CHUNK):
+            schunk = chunk[sidx:sidx + SQLITE_CHUNK]
+            sql = CACHE['ROBOT'].format(robotids=','.join(['?'] * len(schunk)))
+            for rows in sqlite_chunks(conn.execute(sql, schunk)):
+                found.update(row['RobotID'] for row in rows)
+                yield add_attributes(rows, attributes, 'RobotID', 'ROBOT')
+        sql = READ['ROBOTCOUNT'].format(range="AND date_filled >= %s ",
+                                        robotids=f"AND loh.RobotID IN ({placeholders}) ")
+        for rows in fetch_chunks(sql, [f"{settled}-01-01"] + chunk):
+            found.update(row['RobotID'] for row in rows)
+            yield add_attributes(rows, attributes, 'RobotID', 'ROBOT')
+    if cache:
+        conn.close()
+    LOGGER.info(f"Filtered to {len(found):,} Robot IDs")
+
+
+def aggregate_chunk(agg, rows):
+    """ Add a chunk of order history rows to a running per-stock aggregation
+        Keyword arguments:
+          agg: aggregation from previous chunks (or None)
+          rows: rows (dictionaries) from an order history aggregation query
+        Returns:
+          Aggregation (dictionary of attribute names, stock attributes keyed by stock,
+          and order counts keyed by (stock, year))
+    """
+    for row in rows:
+        if agg is None:
+            agg = {'attributes': [col for col in ATTRIBUTES if col in row],
+                   'stock': {}, 'counts': {}}
+        key = row['stock_name'] if row['stock_name'] else row.get('RobotID')
+        # Stock attributes come from the first row for each stock
+        if key not in agg['stock']:
+            agg['stock'][key] = [row[col] for col in agg['attributes']]
+        agg['counts'][(key, row['year'])] = row['cnt']
+    return agg
+
+
+def finish_report(agg):
+    """ Produce a report with one row per stock and one column per year from an aggregation
+        Keyword arguments:
+          agg: aggregation from aggregate_chunk
+        Returns:
+          Dataframe
+    """
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+    import pandas as pd
+    maxyear = datetime.datetime.now().year
+    if agg is None:
+        return pd.DataFrame(columns=['Stock', *ATTRIBUTES.values(), maxyear, 'Total'])
+    stocks = list(agg['stock'])
+    position = {stock: idx for idx, stock in enumerate(stocks)}
+    minyear = min(min(int(year) for _, year in agg['counts']), maxyear)
+    counts = np.zeros((len(stocks), maxyear - minyear + 1), dtype='int64')
+    for (stock, year), cnt in agg['counts'].items():
+        counts[position[stock], int(year) - minyear] = cnt
+    pdf = pd.DataFrame(list(agg['stock'].values()),
+                       columns=[ATTRIBUTES[col] for col in agg['attributes']])
+    for col in pdf.columns:
+        if not pd.api.types.is_numeric_dtype(pdf[col]):
+            pdf[col] = pdf[col].astype('category')
+    pdf.insert(0, 'Stock', stocks)
+    counts = pd.DataFrame(counts, columns=list(range(minyear, maxyear + 1)))
+    counts['Total'] = counts.sum(axis=1)
+    return pd.concat([pdf, counts], axis=1)
+
+
+def write_xlsx(pdf, filename):
+    """ Write a report to an Excel spreadsheet using a streaming (write-only) workbook
+        Keyword arguments:
+          pdf: dataframe
+          filename: output file
+        Returns:
+          None
+    """
+    # pylint: disable=import-outside-toplevel
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(list(pdf.columns))
+    for idx in range(0, pdf.shape[0], WRITE_CHUNK):
+        chunk = pdf.iloc[idx:idx + WRITE_CHUNK].astype(object)
+        for row in chunk.where(chunk.notna(), None).itertuples(index=False, name=None):
+            sheet.append(row)
+    workbook.save(filename)
+
+
+def write_report(pdf, filename):
+    """ Write a report in the format specified by --format
+        Keyword arguments:
+          pdf: dataframe
+          filename: output file
+        Returns:
+          None
+    """
     try:
-        DB['flyboy']['cursor'].execute(READ['ROBOT'])
-        rows = DB['flyboy']['cursor'].fetchall()
-    except MySQLdb.Error as err:
-        terminate_program(JRC.sql_error(err))
-    LOGGER.info(f"Found {len(rows):,} rows")
-    return frobotids, rows
+        if ARG.FORMAT == 'csv':
+            pdf.to_csv(filename, index=False, chunksize=WRITE_CHUNK)
+        elif ARG.FORMAT == 'parquet':
+            # Parquet requires string column names and single-typed columns
+            pdf = pdf.rename(columns=str).astype({'Stock': str})
+            pdf.to_parquet(filename, index=False, row_group_size=WRITE_CHUNK)
+        else:
+            write_xlsx(pdf, filename)
+    except ImportError as err:
+        terminate_program(f"Could not write {ARG.FORMAT} output: {err}")
 
 
 def produce_report():
@@ -117,38 +522,22 @@ def produce_report():
         Returns:
           None
     """
-    robotids, rows = search_by_robotid() if ARG.FILE else search_by_stock()
-    stock = {}
-    minyear = maxyear = datetime.datetime.now().year
-    for row in rows:
-        key = row['stock_name'] if row['stock_name'] else row['RobotID']
-        if ARG.FILE and (str(row['RobotID']) not in robotids):
-            continue
-        if row['year'] < minyear:
-            minyear = row['year']
-        if key not in stock:
-            stock[key] = {'project': row['project'], 'subcat': row['subcat'],
-                          'genotype': row['genotype'], 'labid': row['labid'],
-                          'robotid': row['RobotID']}
-        stock[key][row['year']] = row['cnt']
-    LOGGER.info(f"Found {len(stock):,} stocks")
-    prow = []
-    for stk, row in stock.items():
-        payload = {'Stock': stk, 'RobotID': row['robotid'], 'Project': row['project'],
-                   'SubCat': row['subcat'], 'Genotype': row['genotype'], 'Lab ID': row['labid']}
-        total = 0
-        for year in range(minyear, maxyear+1):
-            if year in row:
-                payload[year] = row[year]
-                total += payload[year]
-            else:
-                payload[year] = 0
-        payload['Total'] = total
-        prow.append(payload)
-    pdf = pd.DataFrame(prow)
-    LOGGER.info(f"Will output {pdf.shape[0]:,} rows for years {minyear}-{maxyear}")
-    filename = 'flystore_order_report.xlsx'
-    pdf.to_excel(filename, index=False)
+    agg = None
+    count = 0
+    cache = None if ARG.NOCACHE else ARG.CACHE
+    if ARG.FILE:
+        chunks = search_by_robotid(ARG.FILE, cache, ARG.REFRESH)
+    else:
+        chunks = search_by_stock(cache, ARG.REFRESH)
+    for rows in chunks:
+        count += len(rows)
+        agg = aggregate_chunk(agg, rows)
+    LOGGER.info(f"Found {count:,} rows")
+    pdf = finish_report(agg)
+    years = [col for col in pdf.columns if isinstance(col, int)]
+    LOGGER.info(f"Will output {pdf.shape[0]:,} rows for years {years[0]}-{years[-1]}")
+    filename = f"flystore_order_report.{ARG.FORMAT}"
+    write_report(pdf, filename)
     print(f"Wrote report to {filename}")
 
 # -----------------------------------------------------------------------------
@@ -158,6 +547,17 @@ if __name__ == '__main__':
         description="FlyStore order report")
     PARSER.add_argument('--file', dest='FILE', action='store',
                         help='File of robot IDs to include')
+    PARSER.add_argument('--cache', dest='CACHE', action='store',
+                        default='flystore_order_cache.db',
+                        help='Cache file for order counts from settled years')
+    PARSER.add_argument('--nocache', dest='NOCACHE', action='store_true',
+                        default=False, help='Query all years from FlyBoy')
+    PARSER.add_argument('--refresh', dest='REFRESH', action='store_true',
+                        default=False, help='Rebuild the cache (for --file: the listed '
+                        + 'robot IDs)')
+    PARSER.add_argument('--format', dest='FORMAT', action='store',
+                        default='xlsx', choices=['xlsx', 'csv', 'parquet'],
+                        help='Output format [xlsx]')
     PARSER.add_argument('--verbose', dest='VERBOSE', action='store_true',
                         default=False, help='Flag, Chatty')
     PARSER.add_argument('--debug', dest='DEBUG', action='store_true',
@@ -5,8 +5,8 @@
 import argparse
 import sys
 import colorlog
-import requests
 import MySQLdb
+import flycore_common as FC
 
 # Database
 READ = {'LINE': "SELECT id FROM line WHERE name=%s",
@@ -36,60 +36,13 @@ PROPS = {"hide": "Y",
         }
 
 # pylint: disable=W0703
-def sql_error(err):
-    """ Log a critical SQL error and exit """
-    try:
-        LOGGER.critical('MySQL error [%d]: %s', err.args[0], err.args[1])
-    except IndexError:
-        LOGGER.critical('MySQL error: %s', err)
-    sys.exit(-1)
-
-
-def db_connect(rdb):
-    """ Connect to specified database
-        Keyword arguments:
-          rdb: database key
-    """
-    LOGGER.info("Connecting to %s on %s", rdb['name'], rdb['host'])
-    try:
-        conn = MySQLdb.connect(host=rdb['host'], user=rdb['user'],
-                               passwd=rdb['password'], db=rdb['name'])
-    except MySQLdb.Error as err:
-        sql_error(err)
-    try:
-        cursor = conn.cursor()
-        return(conn, cursor)
-    except MySQLdb.Error as err:
-        sql_error(err)
-
-
-def call_responder(server, endpoint):
-    """ Call a responder
-        Keyword arguments:
-          server: server
-          endpoint: REST endpoint
-    """
-    url = CONFIG[server]['url'] + endpoint
-    try:
-        req = requests.get(url)
-    except requests.exceptions.RequestException as err:
-        LOGGER.critical(err)
-        sys.exit(-1)
-    if req.status_code != 200:
-        LOGGER.error('Status: %s (%s)', str(req.status_code), url)
-        sys.exit(-1)
-    return req.json()
-
-
 def initialize_program():
     """ Get configuration data
     """
     # pylint: disable=W0603
     global CONFIG
-    dbc = call_responder('config', 'config/db_config')
-    data = dbc['config']
-    (CONN['sage'], CURSOR['sage']) = db_connect(data['sage'][ARG.MANIFOLD])
-    dbc = call_responder('config', 'config/rest_services')
+    (CONN['sage'], CURSOR['sage']) = FC.connect_database(CONFIG, 'sage', ARG.MANIFOLD)
+    dbc = FC.get_config(CONFIG, 'config/rest_services')
     CONFIG = dbc['config']
 
 
@@ -177,7 +130,7 @@ def insert_line(split, split_half):
     try:
         CURSOR['sage'].execute(WRITE['ILINE'], [split['line']])
     except MySQLdb.Error as err:
-        sql_error(err)
+        FC.sql_error(err)
     line_id = CURSOR['sage'].lastrowid
     if line_id:
         LOGGER.info("Inserted line %s (%s)", split['line'], line_id)
@@ -214,7 +167,7 @@ def check_split_halves(split):
         try:
             CURSOR['sage'].execute(READ['LINE'], [half])
         except MySQLdb.Error as err:
-            sql_error(err)
+            FC.sql_error(err)
         row = CURSOR['sage'].fetchone()
         if row:
             split_half[row[0]] = 1
@@ -239,7 +192,7 @@ def check_existing_line(line_id, split, split_half):
     try:
         CURSOR['sage'].execute(READ['RELATIONSHIP'], [split['line']])
     except MySQLdb.Error as err:
-        sql_error(err)
+        FC.sql_error(err)
     rows = CURSOR['sage'].fetchall()
     if len(rows) != 2:
         error += 1
@@ -261,16 +214,18 @@ def check_existing_line(line_id, split, split_half):
 def update_initial_splits():
     """ Synchronize ibitial split lines """
     LOGGER.info("Fetching initial splits from Fly Core")
+    FC.phase('fetch')
     if ARG.LINE:
-        splits = call_responder('flycore', '?request=initial_split;line=' + ARG.LINE)
+        splits = FC.call_responder(CONFIG, 'flycore', '?request=initial_split;line=' + ARG.LINE)
     else:
-        splits = call_responder('flycore', '?request=initial_splits')
+        splits = FC.call_responder(CONFIG, 'flycore', '?request=initial_splits')
     LOGGER.info("Found %d initial splits in Fly Core", len(splits['splits']))
+    FC.phase('process')
     for split in splits['splits']:
         try:
             CURSOR['sage'].execute(READ['LINE'], [split['line']])
         except MySQLdb.Error as err:
-            sql_error(err)
+            FC.sql_error(err)
         row = CURSOR['sage'].fetchone()
         line_id = row[0] if row else 0
         if (line_id and not ARG.ALL):
@@ -287,7 +242,9 @@ def update_initial_splits():
             insert_line(split, split_half)
 
     if ARG.WRITE:
+        FC.phase('commit')
         CONN['sage'].commit()
+    FC.phase()
     print("Split crosses:  %d" % len(splits['splits']))
 
 
@@ -302,6 +259,8 @@ if __name__ == '__main__':
     PARSER.add_argument('--write', dest='WRITE', action='store_true',
                         default=False,
                         help='Flag, Actually modify database')
+    PARSER.add_argument('--metrics', dest='METRICS', action='store',
+                        help='Write metrics to this file (.prom or JSON)')
     PARSER.add_argument('--verbose', dest='VERBOSE', action='store_true',
                         default=False, help='Flag, Chatty')
     PARSER.add_argument('--debug', dest='DEBUG', action='store_true',
@@ -320,6 +279,10 @@ if __name__ == '__main__':
     HANDLER.setFormatter(colorlog.ColoredFormatter())
     LOGGER.addHandler(HANDLER)
 
+    FC.register_statements(READ=READ, WRITE=WRITE)
+    if ARG.METRICS:
+        FC.export_metrics(ARG.METRICS, 'sync_flyf_initial_splits', COUNT)
+    FC.phase('config')
     initialize_program()
     update_initial_splits()
     print("Lines read:     %d" % COUNT['read'])
@@ -5,9 +5,8 @@ import argparse
 import re
 import sys
 import colorlog
-import requests
 import MySQLdb
-from tqdm import tqdm
+import flycore_common as FC
 
 # Database
 READ = {'STOCKS': "SELECT name,flycore_id FROM line_vw WHERE flycore_id IS NOT NULL",
@@ -36,60 +35,13 @@ WARNINGS = []
 
 # pylint: disable=W0703,R1710
 
-def sql_error(err):
-    """ Log a critical SQL error and exit """
-    try:
-        LOGGER.critical('MySQL error [%d]: %s', err.args[0], err.args[1])
-    except IndexError:
-        LOGGER.critical('MySQL error: %s', err)
-    sys.exit(-1)
-
-
-def db_connect(rdb):
-    """ Connect to specified database
-        Keyword arguments:
-          rdb: database key
-    """
-    LOGGER.info("Connecting to %s on %s", rdb['name'], rdb['host'])
-    try:
-        conn = MySQLdb.connect(host=rdb['host'], user=rdb['user'],
-                               passwd=rdb['password'], db=rdb['name'])
-    except MySQLdb.Error as err:
-        sql_error(err)
-    try:
-        cursor = conn.cursor()
-        return(conn, cursor)
-    except MySQLdb.Error as err:
-        sql_error(err)
-
-
-def call_responder(server, endpoint):
-    """ Call a responder
-        Keyword arguments:
-          server: server
-          endpoint: REST endpoint
-    """
-    url = CONFIG[server]['url'] + endpoint
-    try:
-        req = requests.get(url, timeout=120)
-    except requests.exceptions.RequestException as err:
-        LOGGER.critical(err)
-        sys.exit(-1)
-    if req.status_code != 200:
-        LOGGER.error('Status: %s (%s)', str(req.status_code), url)
-        sys.exit(-1)
-    return req.json()
-
-
 def initialize_program():
     """ Get configuration data
     """
     # pylint: disable=W0603
     global CONFIG
-    dbc = call_responder('config', 'config/db_config')
-    data = dbc['config']
-    (CONN['sage'], CURSOR['sage']) = db_connect(data['sage'][ARG.MANIFOLD])
-    dbc = call_responder('config', 'config/rest_services')
+    (CONN['sage'], CURSOR['sage']) = FC.connect_database(CONFIG, 'sage', ARG.MANIFOLD)
+    dbc = FC.get_config(CONFIG, 'config/rest_services')
     CONFIG = dbc['config']
 
 
@@ -101,7 +53,7 @@ def get_line_id(line):
         CURSOR['sage'].execute(READ['LINEID'], [line])
         lrow = CURSOR['sage'].fetchone()
     except MySQLdb.Error as err:
-        sql_error(err)
+        FC.sql_error(err)
     if not lrow:
         LOGGER.error("Line %s is not in SAGE", line)
         COUNT['error'] += 1
@@ -138,7 +90,7 @@ def set_publishing_name(line, row):
         CURSOR['sage'].execute(READ['EXISTS'], (line_id, publishing_name))
         lrow = CURSOR['sage'].fetchone()
     except MySQLdb.Error as err:
-        sql_error(err)
+        FC.sql_error(err)
     COUNT['updated' if lrow else 'inserted'] += 1
     if not lrow:
         LOGGER.info("New %s %s for %s", utype, publishing_name, line)
@@ -149,7 +101,7 @@ def set_publishing_name(line, row):
                                                      *row[slice(2, 9)],))
     except MySQLdb.Error as err:
         print(row)
-        sql_error(err)
+        FC.sql_error(err)
 
 
 def error_condition(stockmap, row):
@@ -189,7 +141,8 @@ def update_publishing_names():
     if not ARG.LINE:
         """ Get mapping of __kp_UniqueID to stock name """
         LOGGER.info("Fetching stock names from Fly Core")
-        #stocks = call_responder('flycore', '?request=named_stocks')
+        FC.phase('prefetch')
+        #stocks = FC.call_responder(CONFIG, 'flycore', '?request=named_stocks')
         #if not stocks or not stocks['stocks']:
         #    LOGGER.critical("No named stocks found in FLYF2")
         #    sys.exit(-1)
@@ -199,17 +152,20 @@ def update_publishing_names():
             CURSOR['sage'].execute(READ['STOCKS'])
             rows = CURSOR['sage'].fetchall()
         except MySQLdb.Error as err:
-            sql_error(err)
+            FC.sql_error(err)
         for row in rows:
             stockmap[row[1]] = row[0]
         LOGGER.info("Found %d named stocks in Fly Core", len(stockmap))
     # Get publishing names
     flycore_sn = {}
     LOGGER.info("Fetching publishing names from Fly Core")
+    FC.phase('fetch')
     if ARG.LINE:
-        response = call_responder('flycore', f"?request=publishing_names_join;line={ARG.LINE}")
+        response = FC.call_responder(CONFIG, 'flycore',
+                                     f"?request=publishing_names_join;line={ARG.LINE}")
     else:
-        response = call_responder('flycore', f"?request=publishing_names_sync;days={ARG.DAYS}")
+        response = FC.call_responder(CONFIG, 'flycore',
+                                     f"?request=publishing_names_sync;days={ARG.DAYS}")
     allnames = response['publishing']
     LOGGER.info("Found %d publishing names in Fly Core", len(allnames))
     if not allnames:
@@ -217,6 +173,8 @@ def update_publishing_names():
         sys.exit(0)
     if ARG.LINE:
         stockmap[allnames[0][0]] = ARG.LINE
+    from tqdm import tqdm  # pylint: disable=import-outside-toplevel
+    FC.phase('process')
     for row in tqdm(allnames):
         # _kf_parent_UID, __kp_name_serial_number, all_names, for_publishing,
         # published, label, display_genotype, who, notes, create_date
@@ -240,7 +198,7 @@ def update_publishing_names():
         CURSOR['sage'].execute(READ['SOURCE'])
         rows = CURSOR['sage'].fetchall()
     except MySQLdb.Error as err:
-        sql_error(err)
+        FC.sql_error(err)
     for row in rows:
         # source_id, id, line
         if not re.search(r"IS\d+", row[2]):
@@ -248,7 +206,9 @@ def update_publishing_names():
     LOGGER.info("Found %d records in FLYF2", len(flycore_sn))
     LOGGER.info("Found %d records in SAGE", len(sage_source))
     if ARG.WRITE:
+        FC.phase('commit')
         CONN['sage'].commit()
+    FC.phase()
     if WARNINGS:
         with open("publishing_name_sync.txt", "w", encoding="ascii") as outstream:
             for line in WARNINGS:
@@ -270,6 +230,8 @@ if __name__ == '__main__':
     PARSER.add_argument('--write', dest='WRITE', action='store_true',
                         default=False,
                         help='Flag, Actually modify database')
+    PARSER.add_argument('--metrics', dest='METRICS', action='store',
+                        help='Write metrics to this file (.prom or JSON)')
     PARSER.add_argument('--verbose', dest='VERBOSE', action='store_true',
                         default=False, help='Flag, Chatty')
     PARSER.add_argument('--debug', dest='DEBUG', action='store_true',
@@ -288,6 +250,10 @@ if __name__ == '__main__':
     HANDLER.setFormatter(colorlog.ColoredFormatter())
     LOGGER.addHandler(HANDLER)
 
+    FC.register_statements(READ=READ, WRITE=WRITE)
+    if ARG.METRICS:
+        FC.export_metrics(ARG.METRICS, 'sync_flyf_publishing_names', COUNT)
+    FC.phase('config')
     initialize_program()
     update_publishing_names()
     print(f"Names read:               {COUNT['read']}")
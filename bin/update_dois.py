@@ -9,10 +9,9 @@ import re
 import sys
 from time import sleep
 import requests
-from unidecode import unidecode
 import MySQLdb
-from tqdm import tqdm
 import jrc_common.jrc_common as JRC
+import flycore_common as FC
 
 # pylint: disable=broad-exception-caught,broad-exception-raised,logging-fstring-interpolation
 
@@ -55,7 +54,7 @@ def call_responder(server, endpoint):
     """
     url = CONFIG[server]['url'] + endpoint
     try:
-        req = requests.get(url, timeout=10)
+        req = FC.SESSION.get(url, timeout=10)
     except requests.exceptions.RequestException as err:
         terminate_program(err)
     if req.status_code != 200:
@@ -78,6 +77,7 @@ def initialize_program():
             DB[source] = JRC.connect_database(dbo)
         except Exception as err:
             terminate_program(err)
+        DB[source]['cursor'] = FC.InstrumentedCursor(DB[source]['cursor'])
 
 
 def call_doi(doi):
@@ -88,7 +88,7 @@ def call_doi(doi):
     url = 'https://api.crossref.org/works/' + doi
     headers = {'mailto': 'svirskasr@hhmi.org'}
     try:
-        req = requests.get(url, headers=headers, timeout=10)
+        req = FC.SESSION.get(url, headers=headers, timeout=10)
     except requests.exceptions.RequestException as err:
         terminate_program(err)
     if req.status_code != 200:
@@ -246,6 +246,7 @@ def process_single_doi(doi, rdict, ddict):
         LOGGER.error("Missing author for %s (%s)", doi, title)
         return
     LOGGER.debug("%s: %s (%s, %s)", doi, title, author, date)
+    from unidecode import unidecode  # pylint: disable=import-outside-toplevel
     title = unidecode(title)
     LOGGER.debug(WRITE['doi'], doi, title, author, date, title, author, date)
     try:
@@ -264,7 +265,10 @@ def update_dois():
         rows = {"dois": [ARG.DOI]}
     else:
         LOGGER.info('Fetching DOIs from FLYF2')
+        FC.phase('fetch')
         rows = call_responder('flycore', '?request=doilist')
+    FC.phase('process')
+    from tqdm import tqdm  # pylint: disable=import-outside-toplevel
     rdict = {}
     ddict = {}
     for doi_string in tqdm(rows['dois'], desc='Process DOIs'):
@@ -275,11 +279,12 @@ def update_dois():
     if not ARG.DOI:
         perform_backcheck(rdict)
     if ARG.WRITE:
+        FC.phase('commit')
         DB['flyboy']['conn'].commit()
         for key in tqdm(ddict, desc='Update config'):
             entry = json.dumps(ddict[key])
             LOGGER.debug(f"Updating {key} in config database")
-            resp = requests.post(CONFIG['config']['url'] + 'importjson/dois/' + key,
+            resp = FC.SESSION.post(CONFIG['config']['url'] + 'importjson/dois/' + key,
                                  {"config": entry}, timeout=10)
             if resp.status_code != 200:
                 LOGGER.error(resp.json()['rest']['message'])
@@ -300,12 +305,18 @@ if __name__ == '__main__':
     PARSER.add_argument('--write', dest='WRITE', action='store_true',
                         default=False,
                         help='Flag, Actually modify database')
+    PARSER.add_argument('--metrics', dest='METRICS', action='store',
+                        help='Write metrics to this file (.prom or JSON)')
     PARSER.add_argument('--verbose', dest='VERBOSE', action='store_true',
                         default=False, help='Flag, Chatty')
     PARSER.add_argument('--debug', dest='DEBUG', action='store_true',
                         default=False, help='Flag, Very chatty')
     ARG = PARSER.parse_args()
     LOGGER = JRC.setup_logging(ARG)
+    FC.register_statements(READ=READ, WRITE=WRITE)
+    if ARG.METRICS:
+        FC.export_metrics(ARG.METRICS, 'update_dois', COUNT)
+    FC.phase('config')
     try:
         CONFIG = JRC.simplenamespace_to_dict(JRC.get_config("rest_services"))
     except Exception as err:
@@ -0,0 +1,30 @@
+-- Stored generated columns and indexes for copy tray and quadrant on the
+-- FlyBoy flipper stock table (used by bin/fix_robot_rack_id.py).
+--
+-- copy_tray[_b]     : first two components of rack_location[_b] (e.g. A.GR59)
+-- relative_rack[_b] : quadrant (A-D) of cell[_b] within the tray
+--
+-- Run once against each FlyBoy manifold:
+--   mysql -h <host> -u <user> -p flyboy < flipper_stock_tray_columns.sql
+
+ALTER TABLE __flipper_flystocks_stock
+  ADD COLUMN copy_tray VARCHAR(64)
+    AS (SUBSTRING_INDEX(rack_location,'.',2)) STORED,
+  ADD COLUMN relative_rack CHAR(1)
+    AS (CASE WHEN cell >0 AND cell <=24 THEN 'A'
+             WHEN cell >24 AND cell <=48 THEN 'B'
+             WHEN cell >48 AND cell <=72 THEN 'C'
+             WHEN cell >72 AND cell <=96 THEN 'D' ELSE NULL END) STORED,
+  ADD COLUMN copy_tray_b VARCHAR(64)
+    AS (SUBSTRING_INDEX(rack_location_b,'.',2)) STORED,
+  ADD COLUMN relative_rack_b CHAR(1)
+    AS (CASE WHEN cell_b >0 AND cell_b <=24 THEN 'A'
+             WHEN cell_b >24 AND cell_b <=48 THEN 'B'
+             WHEN cell_b >48 AND cell_b <=72 THEN 'C'
+             WHEN cell_b >72 AND cell_b <=96 THEN 'D' ELSE NULL END) STORED;
+
+ALTER TABLE __flipper_flystocks_stock
+  ADD INDEX copy_tray_rack_ind (copy_tray,relative_rack,rack),
+  ADD INDEX copy_tray_b_rack_ind (copy_tray_b,relative_rack_b,rack_b),
+  ADD INDEX last_flipped_tray_ind (last_flipped,copy_tray),
+  ADD INDEX last_flipped_b_tray_ind (last_flipped_b,copy_tray_b);